@@ -0,0 +1,155 @@
+import asyncio, time
+from collections import deque
+from logger_conf import setup_logger
+from metrics import metrics
+
+try:
+    import psutil
+except ImportError:  # memory-based backoff is skipped without psutil
+    psutil = None
+
+logger = setup_logger("concurrency")
+
+FAILURE_OUTCOMES = ("timeout", "throttled", "server_error")
+
+class _Window:
+    # rolling window of (latency, outcome) for one scope
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+
+    def add(self, latency, outcome):
+        self.samples.append((latency, outcome))
+
+    def failure_rate(self):
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, o in self.samples if o in FAILURE_OUTCOMES) / len(self.samples)
+
+    def latency_pct(self, q):
+        lat = sorted(l for l, o in self.samples if o not in FAILURE_OUTCOMES)
+        if not lat:
+            return None
+        return lat[min(len(lat) - 1, int(q * len(lat)))]
+
+
+class _Scope:
+    def __init__(self, limit, window):
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.window = _Window(window)
+        self.last_decrease = 0.0
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency control for PageFetcher, globally and per domain.
+
+    Every successful fetch grows a scope's limit by 1/limit (about +1 per
+    window of successes) while its rolling p95 latency stays under
+    latency_target. A domain's limit halves on a timeout, 429 or 5xx; the
+    global limit halves when the overall failure rate passes 20% or browser
+    memory exceeds memory_limit_mb; either halves on a p95 over target. At
+    most one decrease per cooldown, so a single burst doesn't collapse it."""
+
+    def __init__(self, initial=4, min_limit=1, max_limit=32, per_domain_initial=2, per_domain_max=6,
+                 latency_target=8.0, window=40, cooldown=5.0, memory_limit_mb=None, memory_check_interval=5.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.per_domain_initial = per_domain_initial
+        self.per_domain_max = per_domain_max
+        self.latency_target = latency_target
+        self.window = window
+        self.cooldown = cooldown
+        self.memory_limit_mb = memory_limit_mb
+        self.memory_check_interval = memory_check_interval
+        self._last_memory_check = 0.0
+        self.glob = _Scope(initial, window * 4)
+        self.domains = {}
+        self.cond = asyncio.Condition()
+        metrics.set_gauge("concurrency_limit", int(self.glob.limit), scope="global")
+
+    def _domain(self, domain):
+        d = self.domains.get(domain)
+        if d is None:
+            d = self.domains[domain] = _Scope(self.per_domain_initial, self.window)
+        return d
+
+    async def acquire(self, domain):
+        d = self._domain(domain)
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.glob.in_flight < int(self.glob.limit) and d.in_flight < int(d.limit))
+            self.glob.in_flight += 1
+            d.in_flight += 1
+            metrics.set_gauge("concurrency_in_flight", self.glob.in_flight, scope="global")
+
+    async def release(self, domain, latency, outcome):
+        d = self._domain(domain)
+        async with self.cond:
+            self.glob.in_flight -= 1
+            d.in_flight -= 1
+            d.window.add(latency, outcome)
+            self.glob.window.add(latency, outcome)
+            self._adjust(d, domain, outcome, 1, self.per_domain_max, "domain")
+            self._adjust(self.glob, None, outcome, self.min_limit, self.max_limit, "global", memory=self._memory_pressure())
+            metrics.set_gauge("concurrency_in_flight", self.glob.in_flight, scope="global")
+            self.cond.notify_all()
+
+    def _adjust(self, s, domain, outcome, lo, hi, scope, memory=False):
+        now = time.monotonic()
+        p95 = s.window.latency_pct(0.95)
+        reason = None
+        if memory:
+            reason = "memory"
+        elif scope == "domain" and outcome in FAILURE_OUTCOMES:
+            reason = outcome
+        elif scope == "global" and s.window.failure_rate() > 0.2:
+            # one bad host shouldn't shrink everyone's share; only a broad failure rate does
+            reason = "failure_rate"
+        elif p95 is not None and p95 > self.latency_target and len(s.window.samples) >= 5:
+            reason = "latency"
+        old = int(s.limit)
+        if reason:
+            if now - s.last_decrease < self.cooldown:
+                return
+            s.limit = max(lo, s.limit / 2)
+            s.last_decrease = now
+            s.window.samples.clear()  # judge the new limit on fresh samples
+            direction = "down"
+        elif outcome == "ok":
+            s.limit = min(hi, s.limit + 1.0 / s.limit)
+            direction = "up"
+            reason = "success"
+        else:
+            return
+        if int(s.limit) != old:
+            labels = {"scope": scope} if domain is None else {"scope": scope, "domain": domain}
+            metrics.inc("concurrency_adjustments_total", scope=scope, direction=direction, reason=reason)
+            metrics.set_gauge("concurrency_limit", int(s.limit), **labels)
+            logger.debug("Concurrency %s %s -> %d (%s, p95=%s)", scope if domain is None else domain, direction, int(s.limit), reason, p95)
+
+    def _memory_pressure(self):
+        if psutil is None or not self.memory_limit_mb:
+            return False
+        now = time.monotonic()
+        if now - self._last_memory_check < self.memory_check_interval:
+            return False
+        self._last_memory_check = now
+        # Chromium's renderers are child processes, so count the whole tree
+        try:
+            proc = psutil.Process()
+            rss = proc.memory_info().rss + sum(c.memory_info().rss for c in proc.children(recursive=True))
+        except psutil.Error:
+            return False
+        rss_mb = rss / (1024 * 1024)
+        metrics.set_gauge("process_tree_rss_mb", round(rss_mb, 1))
+        return rss_mb > self.memory_limit_mb
+
+
+def classify_outcome(status=None, exc=None):
+    # coarse outcome used by the limiter; 4xx other than 429 is the site's answer, not overload
+    if exc is not None:
+        return "timeout" if "timeout" in type(exc).__name__.lower() or "timeout" in str(exc).lower()[:200] else "error"
+    if status == 429:
+        return "throttled"
+    if status is not None and status >= 500:
+        return "server_error"
+    return "ok"
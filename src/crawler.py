@@ -2,11 +2,23 @@ import datetime
 import re
 import asyncio, time, random
 from fetcher import PageFetcher
-from extractor import Extractor
-from db import SessionLocal
-from models import Resort, RawPage, ExtractionLog
-from logger_conf import setup_logger
-from utils import domain_from_url, sleep_random
+from extractor import Extractor, textify
+from db import AsyncSessionLocal
+from models import Resort, RawPage
+from sqlalchemy import select
+from logger_conf import setup_logger, PER_URL
+from metrics import metrics
+from utils import domain_from_url, sleep_random, canonicalize_url, source_type
+from near_dup import NearDuplicateIndex
+from provenance import ProvenanceWriter, prune as prune_provenance
+from normalize import normalize_to_resort, apply_resort_fields
+from frontier import Frontier
+from sitemap import SitemapDiscovery
+from prioritizer import Prioritizer
+from concurrency import AdaptiveLimiter
+from readiness import ReadinessProfiles
+from resource_policy import ResourcePolicy, DEFAULT_BLOCKED_TYPES
+from retry import CircuitBreaker, backoff_delay, is_transient
 import requests
 from bs4 import BeautifulSoup
 from duckduckgo_search import DDGS
@@ -17,157 +29,371 @@ logger = setup_logger("crawler")
 class Crawler:
     def __init__(self, config):
         self.config = config
-        self.fetcher = PageFetcher(user_agent=config['user_agent'], concurrency=config['concurrency'], per_domain_delay=tuple(config['per_domain_delay_seconds']))
-        self.session = SessionLocal()
-        self.extractor = Extractor(self.session)
+        self.limiter = AdaptiveLimiter(initial=config['concurrency'], min_limit=config.get('concurrency_min', 1),
+                                       max_limit=config.get('concurrency_max', config['concurrency']),
+                                       per_domain_initial=config.get('per_domain_concurrency', 2),
+                                       per_domain_max=config.get('per_domain_concurrency_max', 6),
+                                       latency_target=config.get('latency_target_seconds', 8.0),
+                                       memory_limit_mb=config.get('memory_limit_mb'))
+        # long-lived session for the extractor's pattern/template caches; page writes use their own
+        self.bank_session = AsyncSessionLocal()
+        self.extractor = Extractor(self.bank_session)
+        self.provenance = ProvenanceWriter(flush_every=config.get('provenance_flush_every', 50))
+        self.readiness = ReadinessProfiles(signature_fn=self.extractor.signature, mode=config.get('readiness_strategy', 'auto'),
+                                           calibration_pages=config.get('readiness_calibration_pages', 2),
+                                           recheck_every=config.get('readiness_recheck_every', 50),
+                                           timeouts=config.get('readiness_timeouts'),
+                                           min_pages=config.get('readiness_calibrate_min_pages', 5),
+                                           default_strategy=config.get('readiness_default_strategy', 'keywords'))
+        self.breaker = CircuitBreaker(failure_threshold=config.get('circuit_failure_threshold', 5),
+                                      open_seconds=config.get('circuit_open_seconds', 60),
+                                      max_open_seconds=config.get('circuit_max_open_seconds', 900))
+        self.resource_policy = ResourcePolicy(enabled=config.get('resource_blocking', True),
+                                              blocked_types=config.get('blocked_resource_types', DEFAULT_BLOCKED_TYPES),
+                                              blocked_hosts=config.get('blocked_hosts'), allow=config.get('resource_allow'))
+        self.fetcher = PageFetcher(user_agent=config['user_agent'], concurrency=config['concurrency'], per_domain_delay=tuple(config['per_domain_delay_seconds']),
+                                   limiter=self.limiter, readiness=self.readiness, breaker=self.breaker, resource_policy=self.resource_policy)
+        # enough workers to keep the limiter's ceiling busy
+        self.num_workers = max(config['concurrency'], config.get('concurrency_max', config['concurrency']))
+        self.queue = None
+        self.seen = set()  # canonical URL keys
+        self.near_dups = NearDuplicateIndex(max_distance=config.get('near_duplicate_distance', 3),
+                                            min_tokens=config.get('near_duplicate_min_tokens', 50))
+        self.stats = {"frontier_duplicates": 0, "near_duplicates": 0, "extracted": 0, "sitemap_urls": 0}
+        self.frontier = Frontier(AsyncSessionLocal, worker_index=config.get('worker_index', 0), num_workers=config.get('num_workers', 1),
+                                 num_shards=config.get('frontier_shards', 64), lease_seconds=config.get('frontier_lease_seconds', 300),
+                                 per_domain=config.get('frontier_lease_per_domain', 4), max_attempts=config['max_retries'])
+        self.discovery_task = None
+        self.run_started_at = None
+        self.sitemaps = SitemapDiscovery(config['user_agent'], max_urls_per_domain=config.get('sitemap_max_urls_per_domain', 300),
+                                         max_sitemaps=config.get('sitemap_max_files_per_domain', 20),
+                                         include=config.get('sitemap_include_pattern'),
+                                         exclude=config.get('sitemap_exclude_pattern')) if config.get('sitemap_discovery', True) else None
+        self.sitemap_tasks = {}  # domain -> task, one sitemap pass per official site per run
+        self.prioritizer = Prioritizer(AsyncSessionLocal)
+        # pages this worker may fetch per run; the frontier hands them out best-scored first
+        budget = config.get('fetch_budget')
+        self.fetch_budget = -(-budget // config.get('num_workers', 1)) if budget else None
+        self.leased = 0
 
     async def start(self):
         await self.fetcher.start()
+        await self.extractor.prepare()
+        await self.prioritizer.load_history()
+        async with AsyncSessionLocal() as session:
+            await self.readiness.load(session)
+        if self.config.get('discover', True) and self.config.get('provenance_retention_days'):
+            # one worker per fleet (the discovering one) applies retention
+            async with AsyncSessionLocal() as session:
+                await session.run_sync(prune_provenance, self.config['provenance_retention_days'])
 
     async def stop(self):
         await self.fetcher.stop()
-        self.session.close()
+        if self.sitemaps is not None:
+            await self.sitemaps.close()
+        await self.extractor.save()
+        async with AsyncSessionLocal() as session:
+            await self.provenance.save(session)
+            await self.readiness.save(session)
+        await self.bank_session.close()
 
-    async def discover_urls(self):
-        urls = set()
-        
+    async def _emit(self, url, anchor=None, via=None):
+        # push a discovered URL straight into the shared frontier; workers lease it from there
+        key = canonicalize_url(url)
+        if key in self.seen:
+            self.stats["frontier_duplicates"] += 1
+            return False
+        self.seen.add(key)
+        self._schedule_sitemaps(url)
+        priority = self.prioritizer.score(url, anchor, via)
+        if not await self.frontier.add([url], priority=priority, requeue_before=self.run_started_at):
+            # already queued by another worker, or crawled earlier in this run
+            self.stats["frontier_duplicates"] += 1
+            return False
+        return True
+
+    def _schedule_sitemaps(self, url):
+        domain = domain_from_url(url)
+        if self.sitemaps is None or not domain or source_type(domain) != "official" or domain in self.sitemap_tasks:
+            return
+        self.sitemap_tasks[domain] = asyncio.create_task(self._discover_sitemaps(domain))
+
+    async def _discover_sitemaps(self, domain):
+        # the site's own map of its pages; lastmod decides what is recrawled
+        try:
+            entries = await self.sitemaps.discover(domain)
+        except Exception as e:
+            logger.warning("Sitemap discovery failed for %s: %s", domain, e)
+            return
+        # one entry per canonical URL (www/bare host, trailing slash...), newest lastmod wins
+        by_key = {}
+        for u, m in entries:
+            key = canonicalize_url(u)
+            if key in self.seen:
+                continue
+            if key not in by_key or (m is not None and (by_key[key][1] is None or m > by_key[key][1])):
+                by_key[key] = (u, m)
+        fresh = list(by_key.values())
+        self.seen.update(by_key)
+        with_lastmod = [(u, m) for u, m in fresh if m is not None]
+        without = [u for u, m in fresh if m is None]
+        try:
+            queued = await self.frontier.add_changed(with_lastmod, priority=[self.prioritizer.score(u, via="sitemap") for u, _ in with_lastmod]) if with_lastmod else 0
+            queued += await self.frontier.add(without, priority=[self.prioritizer.score(u, via="sitemap") for u in without], requeue_before=self.run_started_at)
+        except Exception as e:
+            # a failed write loses this site's sitemap URLs, not the crawl
+            logger.warning("Queueing sitemap URLs for %s failed: %s", domain, e)
+            self.seen.difference_update(by_key)
+            return
+        self.stats["sitemap_urls"] += len(fresh)
+        logger.info("Queued %d of %d sitemap URLs for %s", queued, len(fresh), domain)
+
+    async def _crawl_list_page(self, list_url):
+        logger.info("Crawling list page for resorts: %s", list_url)
+        status, html, blocked, _ = await self.fetcher.fetch(list_url, render_js=False)
+        if blocked or not html:
+            return
+        soup = BeautifulSoup(html, "lxml")
+        lookups = []
+        # Extract links likely to be resorts (improved patterns)
+        for a in soup.find_all("a", href=True):
+            logger.debug("Checking link: %s", a, extra=PER_URL)
+            href = a['href']
+            text_lower = a.text.lower()
+            if any(term in href.lower() or term in text_lower for term in ["ski-resort", "resort", "ski-area", "skiing", "powderhounds.com/", "snowmagazine.com/ski-resort-guide"]):
+                full_url = urljoin(list_url, href)
+                if full_url.startswith("http") and "wikipedia.org" not in full_url or "en.wikipedia.org/wiki/" in full_url:  # Include wiki resort pages
+                    await self._emit(full_url, anchor=a.text, via="seed")
+                # If aggregator/review (e.g., skiresort.info, powderhounds, snowmagazine), fetch and extract official homepage
+                if any(domain in full_url for domain in ["skiresort.info", "powderhounds.com", "snowmagazine.com", "onthesnow.com"]):
+                    lookups.append(asyncio.create_task(self._resolve_official_link(full_url)))
+        # aggregator lookups run concurrently, bounded by the fetcher's limits
+        await asyncio.gather(*lookups, return_exceptions=True)
+
+    async def _resolve_official_link(self, full_url):
+        off_status, off_html, _, _ = await self.fetcher.fetch(full_url)
+        if not off_html:
+            return
+        off_soup = BeautifulSoup(off_html, "lxml")
+        # Improved selector: look for "official", "homepage", "website", or class/id patterns
+        official_link = off_soup.find("a", string=re.compile(r"(official|homepage|website|visit site)", re.I)) or \
+                        off_soup.find("a", attrs={"class": re.compile(r"(external|link|official)", re.I)}) or \
+                        off_soup.find("a", href=re.compile(r"(ski|resort|official)\.(com|net|org|at|ch|fr|it|ca|jp)"))
+        if official_link and 'href' in official_link.attrs:
+            await self._emit(urljoin(full_url, official_link['href']), anchor=official_link.get_text(" ", strip=True), via="official_link")
+
+    @staticmethod
+    def _ddg_search(q):
+        # DDGS is synchronous; run in a worker thread so it doesn't block the loop
+        with DDGS() as ddgs:
+            return list(ddgs.text(q, region="wt-wt", safesearch="off", max_results=500))
+
+    async def _search(self, q):
+        logger.info("Discovering for query: %s", q)
+        try:
+            results = await asyncio.to_thread(self._ddg_search, q)
+        except Exception as e:
+            logger.warning("DuckDuckGo search failed for '%s': %s", q, e)
+            return
+        for r in results:
+            href = r.get("href")
+            if href and any(term in href.lower() for term in ["resort", "ski", "snow", "mountain"]):
+                await self._emit(href, anchor=r.get("title"), via="search")
+
+    async def discover(self):
         # Hardcoded seed list pages for autonomy (based on reliable sources; can be config['seed_list_urls'])
         seed_list_pages = self.config.get("seed_search_queries", [])
-        # Handle pagination for skiresort.info (up to 5 pages for ~250 resorts; adjust as needed)
-        # for page_num in range(1, 6):  # Limits to initial pages to avoid overload
-        #     paginated_url = f"https://www.skiresort.info/ski-resorts/page/{page_num}/"
-        #     seed_list_pages.append(paginated_url)
-        
-        # Fetch and parse seed list pages for resort links
-        for list_url in seed_list_pages:
-            logger.info("Crawling list page for resorts: %s", list_url)
-            status, html, blocked = await self.fetcher.fetch(list_url, render_js=False)
-            if blocked or not html:
-                continue
-            soup = BeautifulSoup(html, "lxml")
-            # Extract links likely to be resorts (improved patterns)
-            for a in soup.find_all("a", href=True):
-                logger.info("Checking link: %s", a)
-                href = a['href']
-                text_lower = a.text.lower()
-                if any(term in href.lower() or term in text_lower for term in ["ski-resort", "resort", "ski-area", "skiing", "powderhounds.com/", "snowmagazine.com/ski-resort-guide"]):
-                    full_url = urljoin(list_url, href)
-                    if full_url.startswith("http") and "wikipedia.org" not in full_url or "en.wikipedia.org/wiki/" in full_url:  # Include wiki resort pages
-                        urls.add(full_url)
-                    # If aggregator/review (e.g., skiresort.info, powderhounds, snowmagazine), fetch and extract official homepage
-                    if any(domain in full_url for domain in ["skiresort.info", "powderhounds.com", "snowmagazine.com", "onthesnow.com"]):
-                        off_status, off_html, _ = await self.fetcher.fetch(full_url)
-                        if off_html:
-                            off_soup = BeautifulSoup(off_html, "lxml")
-                            # Improved selector: look for "official", "homepage", "website", or class/id patterns
-                            official_link = off_soup.find("a", string=re.compile(r"(official|homepage|website|visit site)", re.I)) or \
-                                            off_soup.find("a", attrs={"class": re.compile(r"(external|link|official)", re.I)}) or \
-                                            off_soup.find("a", href=re.compile(r"(ski|resort|official)\.(com|net|org|at|ch|fr|it|ca|jp)"))
-                            if official_link and 'href' in official_link.attrs:
-                                off_href = urljoin(full_url, official_link['href'])
-                                urls.add(off_href)
         queries = self.config.get("additional_queries", [])
-        with DDGS() as ddgs:
-            for q in queries:
-                logger.info("Discovering for query: %s", q)
-                try:
-                    results = ddgs.text(q, region="wt-wt", safesearch="off", max_results=500)
-                    for r in results:
-                        href = r.get("href")
-                        if href and any(term in href.lower() for term in ["resort", "ski", "snow", "mountain"]):
-                            urls.add(href)
-                except Exception as e:
-                    logger.warning("DuckDuckGo search failed for '%s': %s", q, e)
-        
-        # Filter out duplicates and limit
-        urls = list(urls)[:self.config['max_discovered_urls']]
-        logger.info("Discovered %d unique URLs", len(urls))
-        return urls
+        self.sitemap_tasks = {}
+        for u in seed_list_pages:
+            self._schedule_sitemaps(u)
+        tasks = [self._crawl_list_page(u) for u in seed_list_pages] + [self._search(q) for q in queries]
+        for res in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(res, Exception):
+                logger.warning("Discovery task failed: %s", res)
+        # sitemap passes started by the tasks above
+        for res in await asyncio.gather(*self.sitemap_tasks.values(), return_exceptions=True):
+            if isinstance(res, Exception):
+                logger.warning("Sitemap task failed: %s", res)
+        logger.info("Discovered %d unique URLs (%d from sitemaps of %d sites)", len(self.seen), self.stats["sitemap_urls"], len(self.sitemap_tasks))
 
     async def process_url(self, url):
-        for attempt in range(self.config['max_retries']):
-            status, html, blocked = await self.fetcher.fetch(url, render_js=False)
-            if blocked:
-                logger.warning("Skipped due to robots.txt: %s", url)
-                return
-            if html:
-                # store raw page
-                rp = RawPage(url=url, domain=domain_from_url(url), status_code=status, html=html)
-                self.session.add(rp)
-                self.session.commit()
-                # extract
-                extracted = self.extractor.extract_all(html)
-                # build normalized resort record
-                resort = self.normalize_to_resort(url, extracted)
-                if resort:
-                    # upsert by URL
-                    existing = self.session.query(Resort).filter(Resort.url==url).first()
-                    if existing:
-                        # update fields if present
-                        for k,v in resort.items():
-                            if v is not None:
-                                setattr(existing, k, v)
-                        self.session.commit()
-                    else:
-                        r = Resort(**resort)
-                        self.session.add(r)
-                        self.session.commit()
-                # log extraction outcomes
-                for fld, val in extracted.items():
-                    if val:
-                        elog = ExtractionLog(url=url, field=fld, value=str(val.get('value')), method="hybrid", confidence=val.get('confidence',0.5))
-                        self.session.add(elog)
-                self.session.commit()
-                return
-            else:
-                await asyncio.sleep(2 ** attempt)
-        logger.warning("Failed to fetch after retries: %s", url)
+        # one attempt; returns (outcome, error kind). Retries are scheduled by
+        # the worker through the frontier so a failing URL doesn't hold a slot.
+        status, html, blocked, error = await self.fetcher.fetch(url, render_js=False)
+        if blocked:
+            logger.warning("Skipped due to robots.txt: %s", url)
+            return "blocked", None
+        if not html:
+            if error and not is_transient(error):
+                return "failed", error
+            return "retry", error or "other"
+        # mirrors and near-identical pages skip extraction and DB writes
+        text = textify(html)
+        _, dup_of = self.near_dups.check_and_add(text, url)
+        if dup_of:
+            await self._observe_yield(url, 0.0)  # a fetch that added nothing
+            self.stats["near_duplicates"] += 1
+            metrics.inc("near_duplicates_total")
+            logger.debug("Skipping %s: near-duplicate of %s", url, dup_of, extra=PER_URL)
+            return "duplicate", None
+        domain = domain_from_url(url)
+        async with AsyncSessionLocal() as session:
+            # store raw page
+            session.add(RawPage(url=url, domain=domain, status_code=status, html=html))
+            with metrics.timer("db_flush_seconds", op="raw_page"):
+                await session.commit()
+            # extract
+            await self.extractor.prepare(domain)
+            t0 = time.perf_counter()
+            extracted = self.extractor.extract_all(html, text=text, domain=domain)
+            timings = self.extractor.last_timings  # read before the next await; other workers reassign it
+            extract_seconds = time.perf_counter() - t0
+            metrics.observe("extract_page_seconds", extract_seconds)
+            await self.extractor.save()
+            self.stats["extracted"] += 1
+            await self._observe_yield(url, sum(1 for v in extracted.values() if v) / max(1, len(extracted)))
+            # provenance rides on the resort commit below
+            self.provenance.record(url, domain, extracted, timings, extract_seconds * 1000, session=session)
+            # build normalized resort record
+            resort = self.normalize_to_resort(url, extracted)
+            if resort:
+                # upsert by URL
+                existing = (await session.execute(select(Resort).where(Resort.url == url))).scalars().first()
+                if existing:
+                    # update fields if present
+                    apply_resort_fields(existing, resort)
+                else:
+                    session.add(Resort(**resort))
+            with metrics.timer("db_flush_seconds", op="resort"):
+                await session.commit()
+        if self.provenance.due:
+            async with AsyncSessionLocal() as session:
+                await self.provenance.save(session)
+        if self.readiness.dirty:
+            async with AsyncSessionLocal() as session:
+                await self.readiness.save(session)
+        metrics.inc("pages_processed_total")
+        return "done", None
 
-    
+    async def _observe_yield(self, url, filled):
+        resync = self.prioritizer.observe(url, filled)
+        if resync:
+            await self.frontier.reprioritize(*resync)
 
     def normalize_to_resort(self, url, extracted):
-        if not extracted:
-            return None
-
-        def safe(v, for_json=False):
-            if v is None:
-                return None
-            val = v.get('value') if isinstance(v, dict) else v
-            if isinstance(val, (datetime.date, datetime.datetime)):
-                if for_json:
-                    return val.isoformat()   # for JSON storage
-                return val.date() if isinstance(val, datetime.datetime) else val  # for Date columns
-            return val
-
-        runs = safe(extracted.get('runs_breakdown'))
-        return {
-            "name": safe(extracted.get('name')),
-            "url": url,
-            "country": safe(extracted.get('country')),
-            "continent": safe(extracted.get('continent')),
-            "lat": safe(extracted.get('lat')),
-            "lon": safe(extracted.get('lon')),
-            "snowfall_inches": safe(extracted.get('snowfall')),
-            "opening_date": safe(extracted.get('opening_date')),   # keep as date
-            "closing_date": safe(extracted.get('closing_date')),   # keep as date
-            "num_lifts": safe(extracted.get('num_lifts')),
-            "runs_easy": runs.get('easy') if runs else None,
-            "runs_intermediate": runs.get('intermediate') if runs else None,
-            "runs_advanced": runs.get('advanced') if runs else None,
-            "day_pass_usd": safe(extracted.get('day_pass_price')),
-            "season_pass_usd": safe(extracted.get('season_pass_price')),
-            # convert values to JSON-safe for the raw column
-            "raw": {k: safe(v, for_json=True) for k, v in extracted.items()}
-        }
+        return normalize_to_resort(url, extracted)
         
-    async def run(self):
-        urls = await self.discover_urls()
-        # for efficient concurrency, use asyncio.gather with chunks
-        sem = asyncio.Semaphore(self.config['concurrency'])
-        async def sem_proc(u):
-            async with sem:
-                await self.process_url(u)
+    async def _feed(self):
+        # lease batches from the frontier into the local queue, keeping it shallow
+        # so leases don't expire while rows wait here
+        poll = self.config.get('frontier_poll_seconds', 0.5)
+        idle_exit = self.config.get('frontier_idle_exit_seconds', 60)
+        idle_since = None
+        while True:
+            room = self.num_workers * 2 - self.queue.qsize()
+            if self.fetch_budget is not None:
+                if self.leased >= self.fetch_budget:
+                    logger.info("Fetch budget of %d pages reached", self.fetch_budget)
+                    return
+                room = min(room, self.fetch_budget - self.leased)
+            batch = await self.frontier.lease(room) if room > 0 else []
+            self.leased += len(batch)
+            unprofiled = self.readiness.unprofiled({domain_from_url(url) for _, url, _ in batch})
+            if unprofiled:
+                # calibrating a domain's readiness only pays off if many of its pages are still to come
+                counts = await self.frontier.pending_by_domain(unprofiled)
+                for domain in unprofiled:
+                    self.readiness.expect(domain, counts.get(domain, 0))
+            for item in batch:
+                await self.queue.put(item)
+            if batch or room <= 0:
+                idle_since = None
+                await asyncio.sleep(0 if batch else poll)
+                continue
+            discovering = self.discovery_task is not None and not self.discovery_task.done()
+            if not discovering and self.queue.empty() and await self.frontier.pending_count() == 0:
+                idle_since = idle_since or time.time()
+                # non-discovering workers wait a while for URLs another worker may still add
+                if self.discovery_task is not None or time.time() - idle_since >= idle_exit:
+                    return
+            else:
+                idle_since = None
+            await asyncio.sleep(poll)
+
+    async def _settle(self, item_id, url, attempts, outcome, error):
+        if outcome != "retry":
+            if outcome == "failed":
+                metrics.inc("pages_failed_total", kind=error)
+                logger.warning("Giving up on %s: %s", url, error)
+            await self.frontier.complete(item_id, outcome)
+            return
+        if error == "circuit_open":
+            # host is known to be down; come back when the breaker will probe it,
+            # and don't count this against the URL's retry budget
+            await self.frontier.retry(item_id, self.breaker.retry_in(domain_from_url(url)), refund_attempt=True)
+            metrics.inc("retries_scheduled_total", kind=error)
+            return
+        if attempts >= self.config['max_retries']:
+            metrics.inc("pages_failed_total", kind=error)
+            logger.warning("Failed to fetch after %d attempts (%s): %s", attempts, error, url)
+            await self.frontier.complete(item_id, "failed")
+            return
+        delay = backoff_delay(attempts, base=self.config.get('retry_base_seconds', 2.0), cap=self.config.get('retry_max_seconds', 600))
+        metrics.inc("retries_scheduled_total", kind=error)
+        logger.debug("Retrying %s in %.1fs (%s, attempt %d)", url, delay, error, attempts, extra=PER_URL)
+        await self.frontier.retry(item_id, delay)
+
+    async def _release(self, item):
+        # settle a row whose processing crashed, so it isn't left leased
+        item_id, url, attempts = item
+        try:
+            await self._settle(item_id, url, attempts, "retry", "other")
+        except Exception:
+            try:
+                await self.frontier.complete(item_id, "failed")
+            except Exception as e:
+                logger.warning("Could not release frontier row %s (%s): %s", item_id, url, e)
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            settled = False
+            try:
+                if item is None:
+                    return
+                item_id, url, attempts = item
+                outcome, error = await self.process_url(url)
+                await self._settle(item_id, url, attempts, outcome, error)
+                settled = True
+                if self.first_processed_at is None:
+                    self.first_processed_at = time.time()
+                    logger.info("First page processed %.1fs after start", self.first_processed_at - self.started_at)
                 await sleep_random(*self.config['per_domain_delay_seconds'])
-        tasks = [asyncio.create_task(sem_proc(u)) for u in urls]
-        for t in tasks:
-            await t
+            except Exception as e:
+                logger.exception("Worker failed on %s: %s", item, e)
+                if item is not None and not settled:
+                    await self._release(item)
+            finally:
+                self.queue.task_done()
+
+    async def run(self):
+        # discovery is a producer into the shared frontier; this process's workers
+        # lease from the shards it owns as soon as the first URL lands
+        self.queue = asyncio.Queue()
+        self.seen = set()
+        self.started_at = time.time()
+        self.run_started_at = datetime.datetime.utcnow()
+        self.first_processed_at = None
+        self.leased = 0
+        if self.config.get('discover', True):
+            self.discovery_task = asyncio.create_task(self.discover())
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+        await self._feed()
+        if self.discovery_task is not None:
+            await self.discovery_task
+        for _ in workers:
+            await self.queue.put(None)
+        await asyncio.gather(*workers)
+        logger.info("Run finished: %d pages extracted, %d duplicate URLs dropped from the frontier, %d near-duplicate pages skipped",
+                    self.stats["extracted"], self.stats["frontier_duplicates"], self.stats["near_duplicates"])
@@ -1,16 +1,69 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, select, update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
-from models import Base
+from models import Base, Resort
+from geo import geohash_encode
 from logger_conf import setup_logger
 
 logger = setup_logger("db")
 
 DATABASE_URL = os.environ.get("DATABASE_URL") or "sqlite:///./ski_crawler.db"
 
-engine = create_engine(DATABASE_URL, future=True, echo=False)
+def async_database_url(url):
+    # same database through an asyncio driver: aiosqlite or asyncpg
+    scheme, sep, rest = url.partition("://")
+    base = scheme.split("+", 1)[0]
+    if base == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    if base in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    return url
+
+ASYNC_DATABASE_URL = async_database_url(DATABASE_URL)
+_sqlite = DATABASE_URL.startswith("sqlite")
+
+# several worker processes may share one SQLite file; wait on the write lock instead of failing
+connect_args = {"timeout": 30} if _sqlite else {}
+engine = create_engine(DATABASE_URL, future=True, echo=False, connect_args=connect_args)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True)
 
+# The crawler's event loop talks to the database through this engine, so
+# queries and commits overlap with fetches instead of stalling them. Each
+# crawler process runs about one DB operation per fetch worker at a time;
+# SQLite serializes writers anyway, so a few connections are enough there.
+_pool_size = int(os.environ.get("DB_POOL_SIZE") or (4 if _sqlite else 10))
+_max_overflow = int(os.environ.get("DB_MAX_OVERFLOW") or (4 if _sqlite else 20))
+async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False, connect_args=connect_args, pool_size=_pool_size,
+                                   max_overflow=_max_overflow, pool_timeout=30, pool_pre_ping=not _sqlite)
+# expire_on_commit=False: attribute access after a commit would otherwise need a lazy load, which async can't do
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+def _upgrade(conn):
+    """create_all only creates missing tables, so columns and indexes added to
+    an existing table since it was created are added here. Idempotent."""
+    insp = inspect(conn)
+    tables = set(insp.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        have = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in have:
+                continue
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(conn.dialect)}")
+            logger.info("Added column %s.%s", table.name, col.name)
+            if table.name == "resorts" and col.name == "geohash":
+                # rows written before the column existed; new writes keep it in step via _sync_geohash
+                rows = conn.execute(select(Resort.id, Resort.lat, Resort.lon).where(Resort.lat.isnot(None), Resort.lon.isnot(None))).all()
+                for rid, lat, lon in rows:
+                    conn.execute(update(Resort).where(Resort.id == rid).values(geohash=geohash_encode(lat, lon), updated_at=Resort.updated_at))
+                logger.info("Backfilled geohash for %d resorts", len(rows))
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
 def init_db():
+    with engine.begin() as conn:
+        _upgrade(conn)
     Base.metadata.create_all(bind=engine)
     logger.info("Database initialized: %s", DATABASE_URL)
@@ -0,0 +1,281 @@
+import argparse, csv, hashlib, os, re, time, unicodedata
+from collections import defaultdict
+from fuzzywuzzy import fuzz
+from sqlalchemy.dialects import postgresql, sqlite
+from db import SessionLocal, init_db, engine
+from models import Resort, ResortXref
+from geo import geohash_encode, haversine_km
+from logger_conf import setup_logger
+
+logger = setup_logger("entity_resolution")
+
+SKIINFO_CSV = os.path.join(os.path.dirname(__file__), "..", "comprehensive_ski_resorts.csv")
+SOURCE_CRAWLER = "crawler"
+SOURCE_SKIINFO = "skiresort.info"
+
+# words that say nothing about which resort a name refers to
+STOPWORDS = {"ski", "skiing", "resort", "resorts", "area", "mountain", "mtn", "the", "and", "of", "at",
+             "official", "site", "website", "home", "homepage", "welcome", "to", "skigebiet", "station",
+             "de", "la", "le", "di", "del", "snow", "park", "lift", "tickets"}
+
+def normalize_name(name, stopwords=STOPWORDS):
+    if not name:
+        return ""
+    s = unicodedata.normalize("NFKD", name)
+    s = "".join(c for c in s if not unicodedata.combining(c)).lower()
+    s = re.sub(r"[^a-z0-9]+", " ", s)
+    return " ".join(t for t in s.split() if t not in stopwords)
+
+def trigrams(s):
+    s = s.replace(" ", "")
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+def blocking_keys(rec):
+    keys = set()
+    for tok in rec["norm"].split():
+        if len(tok) > 2:
+            keys.add("t:" + tok)
+    for g in trigrams(rec["norm"]):
+        keys.add("g:" + g)
+    for c in rec["countries"]:
+        prefix = rec["norm"][:3]
+        if prefix:
+            keys.add(f"k:{c}:{prefix}")
+    if rec["geohash"]:
+        keys.add("c:" + rec["geohash"][:4])
+    return keys
+
+def _record(source, key, name, countries=(), lat=None, lon=None, ref=None):
+    return {
+        "source": source,
+        "key": key,
+        "name": name,
+        "norm": normalize_name(name),
+        "full": normalize_name(name, ()),
+        "countries": {c.strip().lower() for c in countries if c and len(c.strip()) > 2},
+        "lat": lat,
+        "lon": lon,
+        "geohash": geohash_encode(lat, lon, 5) if lat is not None and lon is not None else None,
+        "ref": ref,
+    }
+
+def load_crawler_records(session):
+    out = []
+    for r in session.query(Resort.id, Resort.url, Resort.name, Resort.country, Resort.lat, Resort.lon).yield_per(1000):
+        out.append(_record(SOURCE_CRAWLER, r.url, r.name, [r.country] if r.country else [], r.lat, r.lon, ref=r.id))
+    return out
+
+def load_skiinfo_records(path=SKIINFO_CSV):
+    out = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            out.append(_record(SOURCE_SKIINFO, row["link"], row["name"], (row.get("country") or "").split("|"), ref=row))
+    return out
+
+def name_score(a, b):
+    ta, tb = set(a["norm"].split()), set(b["norm"].split())
+    if len(ta & tb) >= 2:
+        # one multi-word name inside the other ("whistler blackcomb" / "whistler blackcomb peak") is still specific
+        return fuzz.token_set_ratio(a["norm"], b["norm"])
+    s = fuzz.token_sort_ratio(a["norm"], b["norm"])
+    if min(len(ta), len(tb)) == 1:
+        # a lone token left after stopword removal ("ridge", "powder") matches far too
+        # much; the words that were dropped have to agree as well
+        s = min(s, fuzz.token_set_ratio(a["full"], b["full"]))
+    return s
+
+def score_pair(a, b):
+    if not a["norm"] or not b["norm"]:
+        return 0
+    s = name_score(a, b)
+    if a["countries"] and b["countries"]:
+        s += 5 if a["countries"] & b["countries"] else -15
+    if a["lat"] is not None and b["lat"] is not None:
+        d = haversine_km(a["lat"], a["lon"], b["lat"], b["lon"])
+        s += 10 if d < 15 else (-20 if d > 100 else 0)
+    return s
+
+
+class _UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        ri, rj = self.find(i), self.find(j)
+        if ri != rj:
+            self.parent[max(ri, rj)] = min(ri, rj)
+
+
+class EntityResolver:
+    def __init__(self, threshold=88, max_block_size=150, max_candidates=40, dedup_sources=(SOURCE_CRAWLER,)):
+        self.threshold = threshold
+        self.max_block_size = max_block_size  # blocks bigger than this are not discriminative
+        self.max_candidates = max_candidates
+        self.dedup_sources = set(dedup_sources)  # sources that may contain duplicates of themselves
+        self.stats = {}
+
+    def _index(self, records):
+        index = defaultdict(list)
+        rec_keys = []
+        for i, rec in enumerate(records):
+            ks = blocking_keys(rec)
+            rec_keys.append(ks)
+            for k in ks:
+                index[k].append(i)
+        dropped = [k for k, v in index.items() if len(v) > self.max_block_size]
+        for k in dropped:
+            del index[k]
+        return index, rec_keys
+
+    def candidate_pairs(self, records):
+        index, rec_keys = self._index(records)
+        for i, ks in enumerate(rec_keys):
+            shared = defaultdict(int)
+            for k in ks:
+                for j in index.get(k, ()):
+                    if j <= i:
+                        continue
+                    a, b = records[i], records[j]
+                    if a["source"] == b["source"] and a["source"] not in self.dedup_sources:
+                        continue
+                    shared[j] += 1
+            # most-shared keys first, so near-identical names get scored before weak trigram hits
+            for j, _ in sorted(shared.items(), key=lambda kv: -kv[1])[:self.max_candidates]:
+                yield i, j
+
+    def resolve(self, records):
+        """Clusters of record indexes that are one resort. A crawled record is
+        linked only to its single best skiresort.info match, and to another
+        crawled record only when each is the other's best match and they
+        don't point at different skiresort.info rows, so clusters can't grow
+        by chaining weak matches together."""
+        t0 = time.time()
+        top = {}  # (record index, other source) -> (score, matched index)
+        n_pairs = 0
+        for i, j in self.candidate_pairs(records):
+            n_pairs += 1
+            s = score_pair(records[i], records[j])
+            if s >= self.threshold:
+                for a, b in ((i, j), (j, i)):
+                    key = (a, records[b]["source"])
+                    if s > top.get(key, (0, None))[0]:
+                        top[key] = (s, b)
+        uf = _UnionFind(len(records))
+        best = {}  # record index -> (score, matched index) of the link it was clustered by
+        for (a, source), (s, b) in top.items():
+            if records[a]["source"] == SOURCE_SKIINFO:
+                continue  # reference rows are linked from the crawled side
+            if source == records[a]["source"]:
+                if top.get((b, source), (0, None))[1] != a:
+                    continue
+                ref_a, ref_b = top.get((a, SOURCE_SKIINFO)), top.get((b, SOURCE_SKIINFO))
+                if ref_a and ref_b and ref_a[1] != ref_b[1]:
+                    continue  # each already has its own reference match; they are different resorts
+            uf.union(a, b)
+            for x, y in ((a, b), (b, a)):
+                if s > best.get(x, (0, None))[0]:
+                    best[x] = (s, y)
+        clusters = defaultdict(list)
+        for i in range(len(records)):
+            clusters[uf.find(i)].append(i)
+        self.stats = {"records": len(records), "pairs_scored": n_pairs,
+                      "all_pairs": len(records) * (len(records) - 1) // 2,
+                      "clusters": len(clusters), "seconds": round(time.time() - t0, 2)}
+        logger.info("Resolved %d records: %d candidate pairs scored (vs %d all-pairs), %d entities in %.2fs",
+                    len(records), n_pairs, self.stats["all_pairs"], len(clusters), self.stats["seconds"])
+        return list(clusters.values()), best
+
+
+def _entity_id(member_keys, existing_ids):
+    # reuse an id already assigned to any member so ids survive re-runs;
+    # otherwise derive one from the smallest member key
+    if existing_ids:
+        return min(existing_ids)
+    return hashlib.sha1(min(member_keys).encode("utf-8")).hexdigest()[:16]
+
+def write_xrefs(session, records, clusters, best):
+    existing = {(x.source, x.source_key): x.entity_id for x in session.query(ResortXref.source, ResortXref.source_key, ResortXref.entity_id)}
+    rows = []
+    for members in clusters:
+        if len(members) < 2:
+            continue
+        keys = [f"{records[i]['source']}|{records[i]['key']}" for i in members]
+        ids = {existing[(records[i]["source"], records[i]["key"])] for i in members if (records[i]["source"], records[i]["key"]) in existing}
+        eid = _entity_id(keys, ids)
+        for i in members:
+            rec = records[i]
+            score = best.get(i, (None, None))[0]
+            rows.append({"entity_id": eid, "source": rec["source"], "source_key": rec["key"],
+                         "resort_id": rec["ref"] if rec["source"] == SOURCE_CRAWLER else None,
+                         "name": rec["name"], "score": score, "method": "blocked_fuzzy"})
+    if not rows:
+        return 0
+    dialect = engine.dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    for start in range(0, len(rows), 500):
+        stmt = insert(ResortXref).values(rows[start:start + 500])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["source", "source_key"],
+            set_={"entity_id": stmt.excluded.entity_id, "resort_id": stmt.excluded.resort_id,
+                  "name": stmt.excluded.name, "score": stmt.excluded.score, "method": stmt.excluded.method},
+        )
+        session.execute(stmt)
+    session.commit()
+    return len(rows)
+
+def merge_skiinfo_fields(session, records, clusters):
+    # fill gaps in crawler rows from the matched skiresort.info row; never overwrite
+    n = ambiguous = 0
+    for members in clusters:
+        info = [records[i]["ref"] for i in members if records[i]["source"] == SOURCE_SKIINFO]
+        crawled = [records[i]["ref"] for i in members if records[i]["source"] == SOURCE_CRAWLER]
+        if not info or not crawled:
+            continue
+        if len(info) > 1:
+            # crawled duplicates matched different skiresort.info rows; no way to tell which is right
+            ambiguous += 1
+            continue
+        row = info[0]
+        fill = {
+            "country": (row.get("country") or "").split("|")[0].strip() or None,
+            "continent": (row.get("continent") or "").split("|")[0].strip() or None,
+            "num_lifts": int(row["num_lifts"]) if (row.get("num_lifts") or "").isdigit() else None,
+            "day_pass_usd": float(row["usd_price"]) if row.get("usd_price") and float(row["usd_price"]) > 0 else None,
+        }
+        for r in session.query(Resort).filter(Resort.id.in_(crawled)):
+            for k, v in fill.items():
+                if v is not None and getattr(r, k) is None:
+                    setattr(r, k, v)
+            n += 1
+    session.commit()
+    if ambiguous:
+        logger.info("Skipped %d clusters matching more than one skiresort.info row", ambiguous)
+    return n
+
+def main():
+    ap = argparse.ArgumentParser(description="Match crawled resorts against the skiresort.info snapshot")
+    ap.add_argument("--csv", default=SKIINFO_CSV)
+    ap.add_argument("--threshold", type=int, default=88)
+    ap.add_argument("--merge", action="store_true", help="fill missing Resort fields from matched skiresort.info rows")
+    args = ap.parse_args()
+    init_db()
+    session = SessionLocal()
+    try:
+        records = load_crawler_records(session) + load_skiinfo_records(args.csv)
+        resolver = EntityResolver(threshold=args.threshold)
+        clusters, best = resolver.resolve(records)
+        n = write_xrefs(session, records, clusters, best)
+        logger.info("Wrote %d cross-reference rows", n)
+        if args.merge:
+            logger.info("Merged skiresort.info fields into %d resorts", merge_skiinfo_fields(session, records, clusters))
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    main()
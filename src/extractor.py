@@ -1,8 +1,11 @@
-import re
+import asyncio, re, time
 from bs4 import BeautifulSoup
 from dateparser import parse as parse_date
 from logger_conf import setup_logger
+from metrics import metrics
 from pattern_learning import PatternBank
+from structured_data import extract_structured
+from wrapper_induction import TemplateBank, LEARN_TIERS
 from fuzzywuzzy import fuzz
 import spacy
 
@@ -74,48 +77,77 @@ DEFAULT_REGEXES = {
 
 # ... (textify, to_inches remain the same)
 
+FIELDS = ["name", "country", "continent", "lat", "lon", "snowfall", "opening_date", "closing_date", "num_lifts", "runs_breakdown", "day_pass_price", "season_pass_price"]
+HTML_FIELDS = ["lat", "lon", "name"]  # matched against raw HTML rather than text
+STRUCTURED_MIN_CONFIDENCE = 0.85  # structured-data hits at or above this skip the regex/NLP tiers
+
 class Extractor:
-    def __init__(self, session):
+    def __init__(self, session, learn=True, tally_templates=False):
         # session is DB session for pattern bank queries
-        self.pattern_bank = PatternBank(session)
+        # one lock: both banks issue their async queries through the same session
+        lock = asyncio.Lock()
+        self.pattern_bank = PatternBank(session, lock=lock)
+        self.templates = TemplateBank(session, lock=lock, learn=learn, tally=tally_templates)
+        self.learn = learn  # False: use stored patterns/templates but never write to the database
+        self.last_timings = {}  # field -> ms spent on it by the last extract_all, hits and misses alike
+
+    async def prepare(self, domain=None):
+        # async sessions only: load what extract_all reads, so it never waits on the database
+        await self.pattern_bank.refresh()
+        if domain:
+            await self.templates.preload(domain)
+
+    async def save(self):
+        # async sessions only: write patterns and templates learned since the last save
+        ok = await self.pattern_bank.save()
+        ok = await self.templates.save() and ok
+        if not ok:
+            # the banks share the session, so a rollback in either expires both caches
+            self.pattern_bank.reset()
+            self.templates.reset()
 
     def extract_field_regex(self, text, field, soup=None):
-        
-        patterns = self.pattern_bank.get_patterns(field) or DEFAULT_REGEXES.get(field, [])
-        for pat in patterns:
+        # stored patterns carry their id into the hit; built-in defaults have none
+        patterns = self.pattern_bank.get_pattern_rows(field) or [(None, p) for p in DEFAULT_REGEXES.get(field, [])]
+        for pattern_id, pat in patterns:
             try:
                 m = re.search(pat, text, re.IGNORECASE | re.DOTALL)
                 if m:
-                    # Expanded parsing logic
-                    if field == "snowfall":
-                        num = m.group(1)
-                        unit = m.group(2) if len(m.groups()) >= 2 else "in"
-                        return {"value": to_inches(num, unit), "raw": m.group(0), "confidence": 0.8}
-                    if field in ("opening_date", "closing_date"):
-                        dt = parse_date(m.group(1))
-                        return {"value": dt.date() if dt else None, "raw": m.group(0), "confidence": 0.8}
-                    if field == "num_lifts":
-                        return {"value": int(m.group(1)), "raw": m.group(0), "confidence": 0.75}
-                    if field in ("day_pass_price", "season_pass_price"):
-                        return {"value": float(m.group(1)), "raw": m.group(0), "confidence": 0.8}
-                    if field == "runs_breakdown":
-                        g = m.groups()
-                        if len(g) >= 3:
-                            return {"value": {"easy": int(g[0]) if g[0].isdigit() else int(g[0].rstrip('%')), "intermediate": int(g[1]) if g[1].isdigit() else int(g[1].rstrip('%')), "advanced": int(g[2]) if g[2].isdigit() else int(g[2].rstrip('%'))}, "raw": m.group(0), "confidence": 0.8}
-                    if field == "name" and soup:
-                        title = soup.find("title")
-                        return {"value": title.text.strip() if title else None, "raw": title.text if title else "", "confidence": 0.9}
-                    if field == "country":
-                        return {"value": m.group(1), "raw": m.group(0), "confidence": 0.7}
-                    if field == "continent":
-                        return {"value": m.group(1), "raw": m.group(0), "confidence": 0.7}
-                    if field in ("lat", "lon"):
-                        return {"value": float(m.group(1)), "raw": m.group(0), "confidence": 0.8}
-                    return {"value": m.group(1), "raw": m.group(0), "confidence": 0.6}
+                    out = self._parse_regex_match(m, field, soup)
+                    out["pattern_id"] = pattern_id
+                    return out
             except Exception as e:
                 logger.exception("Regex error: %s", e)
         return None
 
+    def _parse_regex_match(self, m, field, soup=None):
+        # Expanded parsing logic
+        if field == "snowfall":
+            num = m.group(1)
+            unit = m.group(2) if len(m.groups()) >= 2 else "in"
+            return {"value": to_inches(num, unit), "raw": m.group(0), "confidence": 0.8}
+        if field in ("opening_date", "closing_date"):
+            dt = parse_date(m.group(1))
+            return {"value": dt.date() if dt else None, "raw": m.group(0), "confidence": 0.8}
+        if field == "num_lifts":
+            return {"value": int(m.group(1)), "raw": m.group(0), "confidence": 0.75}
+        if field in ("day_pass_price", "season_pass_price"):
+            return {"value": float(m.group(1)), "raw": m.group(0), "confidence": 0.8}
+        if field == "runs_breakdown":
+            g = m.groups()
+            if len(g) >= 3:
+                return {"value": {"easy": int(g[0]) if g[0].isdigit() else int(g[0].rstrip('%')), "intermediate": int(g[1]) if g[1].isdigit() else int(g[1].rstrip('%')), "advanced": int(g[2]) if g[2].isdigit() else int(g[2].rstrip('%'))}, "raw": m.group(0), "confidence": 0.8}
+        if field == "name" and soup:
+            title = soup.find("title")
+            return {"value": title.text.strip() if title else None, "raw": title.text if title else "", "confidence": 0.9}
+        if field == "country":
+            return {"value": m.group(1), "raw": m.group(0), "confidence": 0.7}
+        if field == "continent":
+            return {"value": m.group(1), "raw": m.group(0), "confidence": 0.7}
+        if field in ("lat", "lon"):
+            return {"value": float(m.group(1)), "raw": m.group(0), "confidence": 0.8}
+        return {"value": m.group(1), "raw": m.group(0), "confidence": 0.6}
+
     def extract_spacy(self, text, field):
         doc = nlp(text[:20000])
         if field in ("opening_date", "closing_date"):
@@ -138,22 +170,70 @@ class Extractor:
                     return {"value": ent.text, "raw": ent.text, "confidence": 0.6}
         return None
 
-    def extract_all(self, html):
+    def extract_all(self, html, text=None, domain=None):
         soup = BeautifulSoup(html, "lxml")
-        text = textify(html)
+        # structured markup first: fields it answers confidently skip the text tiers entirely
+        with metrics.timer("extract_structured_seconds"):
+            structured = extract_structured(soup)
         result = {}
-        fields = ["name", "country", "continent", "lat", "lon", "snowfall", "opening_date", "closing_date", "num_lifts", "runs_breakdown", "day_pass_price", "season_pass_price"]
-        for f in fields:
-            out = self.extract_field_regex(html if f in ["lat", "lon", "name"] else text, f, soup=soup)  # Use raw HTML for some
+        self.last_timings = {}
+        for f in FIELDS:
+            t0 = time.perf_counter()
+            hit = structured.get(f)
+            if hit and hit["confidence"] >= STRUCTURED_MIN_CONFIDENCE:
+                metrics.inc("extract_field_total", field=f, tier="structured")
+                result[f] = dict(hit, tier="structured")
+                self.last_timings[f] = (time.perf_counter() - t0) * 1000
+                continue
+            # then selectors learned from earlier pages of the same site
+            tpl = self.templates.apply(soup, domain, f) if domain else None
+            if tpl:
+                elapsed = time.perf_counter() - t0
+                metrics.observe("extract_field_seconds", elapsed, field=f, tier="template")
+                metrics.inc("extract_field_total", field=f, tier="template")
+                result[f] = dict(tpl, tier="template")
+                self.last_timings[f] = elapsed * 1000
+                continue
+            if text is None:
+                text = textify(html)
+            tier = "regex"
+            out = self.extract_field_regex(html if f in HTML_FIELDS else text, f, soup=soup)  # Use raw HTML for some
             if not out:
+                tier = "spacy"
                 out = self.extract_spacy(text, f)
             if not out:
+                tier = "auto_pattern"
                 candidate = self.find_candidate_and_save_pattern(text, f)
                 if candidate:
                     out = candidate
-            result[f] = out
+            if not out and hit:
+                tier, out = "structured", hit
+            if not out:
+                tier = "none"
+            elapsed = time.perf_counter() - t0
+            metrics.observe("extract_field_seconds", elapsed, field=f, tier=tier)
+            metrics.inc("extract_field_total", field=f, tier=tier)
+            if self.learn and domain and out and tier in LEARN_TIERS:
+                self.templates.learn(soup, domain, f, out)
+            result[f] = dict(out, tier=tier) if out else None
+            self.last_timings[f] = elapsed * 1000
+        if domain:
+            self.templates.flush()
         return result
 
+    def signature(self, html):
+        # structured and regex-tier values only: cheap and free of side effects, used to tell
+        # whether two renders of the same page would extract the same thing
+        soup = BeautifulSoup(html, "lxml")
+        text = textify(html)
+        out = {}
+        for f in FIELDS:
+            r = self.extract_field_regex(html if f in HTML_FIELDS else text, f, soup=soup)
+            out[f] = r.get("value") if r else None
+        for f, hit in extract_structured(soup).items():
+            out["structured:" + f] = hit["value"]
+        return out
+
     def find_candidate_and_save_pattern(self, text, field):
         # Improved heuristic: higher fuzzy threshold, more keywords
         keywords = {
@@ -184,29 +264,36 @@ class Extractor:
                     unit = m.group(2) if len(m.groups()) > 1 else ""
                     # Loose pattern: kw + context + capture group
                     pattern = rf"{re.escape(kw)}[\s\:\-\,\w\(\)]{{0,50}}([0-9]{{1,5}}(?:\.[0-9]{{1,}})?|[A-Za-z]+\s*\d{{1,2}}(?:,\s*\d{{4}})?)\s*(cm|in|inches|\$|%|km|miles|lifts|runs)?"
-                    self.pattern_bank.add_pattern(field, pattern, source="auto", confidence=0.6)  # Higher confidence
-                    # Parse tentative value
-                    if field == "snowfall":
-                        return {"value": to_inches(num_or_val, unit), "raw": snippet.strip(), "confidence": 0.6}
-                    if field in ("day_pass_price", "season_pass_price"):
-                        try:
-                            return {"value": float(num_or_val), "raw": snippet.strip(), "confidence": 0.6}
-                        except:
-                            pass
-                    if field == "num_lifts":
-                        try:
-                            return {"value": int(num_or_val), "raw": snippet.strip(), "confidence": 0.6}
-                        except:
-                            pass
-                    if field in ("opening_date", "closing_date"):
-                        dt = parse_date(num_or_val)
-                        if dt:
-                            return {"value": dt.date(), "raw": snippet.strip(), "confidence": 0.6}
-                    if field in ("lat", "lon"):
-                        try:
-                            return {"value": float(num_or_val), "raw": snippet.strip(), "confidence": 0.6}
-                        except:
-                            pass
-                    if field == "country" or field == "continent":
-                        return {"value": num_or_val, "raw": snippet.strip(), "confidence": 0.6}
+                    learned = self.pattern_bank.add_pattern(field, pattern, source="auto", confidence=0.6) if self.learn else None  # Higher confidence
+                    hit = self._candidate_value(field, num_or_val, unit, snippet)
+                    if hit:
+                        hit["pattern_id"] = learned.id if learned is not None else None
+                        return hit
+        return None
+
+    def _candidate_value(self, field, num_or_val, unit, snippet):
+        # Parse tentative value
+        if field == "snowfall":
+            return {"value": to_inches(num_or_val, unit), "raw": snippet.strip(), "confidence": 0.6}
+        if field in ("day_pass_price", "season_pass_price"):
+            try:
+                return {"value": float(num_or_val), "raw": snippet.strip(), "confidence": 0.6}
+            except:
+                pass
+        if field == "num_lifts":
+            try:
+                return {"value": int(num_or_val), "raw": snippet.strip(), "confidence": 0.6}
+            except:
+                pass
+        if field in ("opening_date", "closing_date"):
+            dt = parse_date(num_or_val)
+            if dt:
+                return {"value": dt.date(), "raw": snippet.strip(), "confidence": 0.6}
+        if field in ("lat", "lon"):
+            try:
+                return {"value": float(num_or_val), "raw": snippet.strip(), "confidence": 0.6}
+            except:
+                pass
+        if field == "country" or field == "continent":
+            return {"value": num_or_val, "raw": snippet.strip(), "confidence": 0.6}
         return None
\ No newline at end of file
@@ -2,7 +2,12 @@ import asyncio
 import urllib
 from playwright.async_api import async_playwright, Browser, Page
 from urllib.parse import urlparse
-from logger_conf import setup_logger
+from logger_conf import setup_logger, PER_URL
+from metrics import metrics
+from concurrency import AdaptiveLimiter, classify_outcome
+from readiness import ReadinessProfiles
+from resource_policy import ResourcePolicy
+from retry import FetchResult, CircuitBreaker, classify_exception, classify_status
 from utils import sleep_random, domain_from_url, allowed_by_robots
 import time
 import numpy as np
@@ -13,12 +18,15 @@ class PageFetcher:
     
     __robots_cache = {}
     
-    def __init__(self, user_agent, concurrency=4, per_domain_delay=(1.0,3.0)):
+    def __init__(self, user_agent, concurrency=4, per_domain_delay=(1.0,3.0), limiter=None, readiness=None, breaker=None, resource_policy=None):
         self.user_agent = user_agent
         self.per_domain_delay = per_domain_delay
         self.playwright = None
         self.browser = None
-        self.lock = asyncio.Semaphore(concurrency)
+        self.limiter = limiter or AdaptiveLimiter(initial=concurrency, max_limit=concurrency)
+        self.readiness = readiness or ReadinessProfiles()
+        self.breaker = breaker or CircuitBreaker()
+        self.resource_policy = resource_policy or ResourcePolicy()
         self.domain_last_access = {}
 
     async def start(self):
@@ -49,45 +57,74 @@ class PageFetcher:
         return allowed
 
     async def _enforce_delay(self, domain):
+        # reserve the next slot for this domain before sleeping, so concurrent
+        # fetches to one host queue up behind each other instead of all
+        # seeing the same last-access time
+        now = time.time()
         last = self.domain_last_access.get(domain)
-        if last:
-            wait = max(0, np.random.uniform(*self.per_domain_delay) - (time.time() - last))
-            if wait > 0:
-                logger.info(f"Enforcing delay of {wait:.2f}s for domain {domain}")
-                await asyncio.sleep(wait)
-        self.domain_last_access[domain] = time.time()
+        slot = now if last is None else max(now, last + np.random.uniform(*self.per_domain_delay))
+        self.domain_last_access[domain] = slot
+        wait = slot - now
+        if wait > 0:
+            logger.debug("Enforcing delay of %.2fs for domain %s", wait, domain, extra=PER_URL)
+            await asyncio.sleep(wait)
 
     async def fetch(self, url, render_js=False, timeout=10000):  # Increased timeout to 6s
         domain = domain_from_url(url)
-        logger.info(f"Checking robots.txt for {url}")
-        if not await self.allowed_by_robots(url):
-            logger.warning(f"Blocked by robots.txt: {url}")
-            return None, None, True
+        if not self.breaker.allow(domain):
+            metrics.inc("fetch_total", outcome="circuit_open")
+            return FetchResult(None, None, False, "circuit_open")
+        logger.debug("Checking robots.txt for %s", url, extra=PER_URL)
+        with metrics.timer("fetch_stage_seconds", stage="robots"):
+            allowed = await self.allowed_by_robots(url)
+        if not allowed:
+            logger.warning("Blocked by robots.txt: %s", url)
+            metrics.inc("fetch_total", outcome="robots_blocked")
+            return FetchResult(None, None, True, None)
 
-        logger.info(f"Enforcing delay for {domain}")
-        await self._enforce_delay(domain)
-        async with self.lock:
-            try:
-                logger.info(f"Creating new context for {url}")
+        with metrics.timer("fetch_stage_seconds", stage="politeness_wait"):
+            await self._enforce_delay(domain)
+        with metrics.timer("fetch_stage_seconds", stage="slot_wait"):
+            await self.limiter.acquire(domain)
+        t0 = time.perf_counter()
+        status, error, kind = None, None, None
+        context = None
+        traffic = None
+        try:
+            with metrics.timer("fetch_stage_seconds", stage="context"):
                 context = await self.browser.new_context(user_agent=self.user_agent, viewport={"width":1280,"height":800}) if render_js else await self.browser.new_context(user_agent=self.user_agent)
-                logger.info(f"Creating new page for {url}")
                 page = await context.new_page()
-                logger.info(f"Navigating to {url} with timeout {timeout}ms")
-                response = await page.goto(url, timeout=timeout)
-                logger.info(f"Navigation complete, status: {response.status if response else 'None'}")
+                traffic = await self.resource_policy.attach(context, page, domain)
+            logger.debug("Navigating to %s with timeout %dms", url, timeout, extra=PER_URL)
+            with metrics.timer("fetch_stage_seconds", stage="navigation"):
+                response = await page.goto(url, timeout=timeout, wait_until="domcontentloaded")
+            status = response.status if response else None
+            kind = classify_status(status)
+            if kind:
+                # error pages aren't worth waiting on or extracting
+                metrics.inc("fetch_total", outcome=kind)
+                logger.info("HTTP %s (%s) for %s", status, kind, url)
+                return FetchResult(status, None, False, kind)
+            # how much longer to wait after DOMContentLoaded is decided per domain
+            with metrics.timer("fetch_stage_seconds", stage="load_state"):
+                html = await self.readiness.settle(page, domain)
+            metrics.observe("fetch_seconds", time.perf_counter() - t0)
+            metrics.inc("fetch_total", outcome="ok")
+            logger.debug("Fetch successful for %s, status: %s", url, status, extra=PER_URL)
+            return FetchResult(status, html, False, None)
+        except Exception as e:
+            error = e
+            kind = classify_exception(e)
+            metrics.inc("fetch_total", outcome=kind)
+            logger.warning("Error fetching %s (%s): %s", url, kind, e)
+            return FetchResult(status, None, False, kind)
+        finally:
+            self.breaker.record(domain, kind)
+            if traffic is not None:
+                self.resource_policy.record(url, traffic)
+            if context is not None:
                 try:
-                    logger.info(f"Waiting for load state (networkidle) for {url}")
-                    await page.wait_for_load_state("networkidle", timeout=timeout)
-                except Exception as e:
-                    logger.warning(f"Networkidle timeout for {url}: {e}. Falling back to domcontentloaded.")
-                    await page.wait_for_load_state("domcontentloaded", timeout=timeout)
-                logger.info(f"Getting page content for {url}")
-                html = await page.content()
-                status = response.status if response else None
-                await page.close()
-                await context.close()
-                logger.info(f"Fetch successful for {url}, status: {status}")
-                return status, html, False
-            except Exception as e:
-                logger.exception(f"Error fetching {url}: {e}")
-                return None, None, False
\ No newline at end of file
+                    await context.close()
+                except Exception:
+                    pass
+            await self.limiter.release(domain, time.perf_counter() - t0, classify_outcome(status, error))
@@ -0,0 +1,201 @@
+import datetime, hashlib, os, socket, uuid
+from sqlalchemy import select, update, func, or_, and_, case
+from sqlalchemy.dialects import postgresql, sqlite
+from models import FrontierUrl
+from utils import canonicalize_url, domain_from_url
+from logger_conf import setup_logger
+
+logger = setup_logger("frontier")
+
+def shard_for(domain, num_shards):
+    # stable across processes and hosts (unlike hash()), and well spread even
+    # for near-identical hostnames, which crc32's low bits are not
+    digest = hashlib.blake2b((domain or "").encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % num_shards
+
+def _priorities(priority, n):
+    return list(priority) if isinstance(priority, (list, tuple)) else [priority] * n
+
+def worker_name(index):
+    return f"{socket.gethostname()}-{os.getpid()}-{index}"
+
+
+class Frontier:
+    """URL frontier shared by every crawler worker through the database.
+
+    Each domain maps to one shard and each shard to one worker (domain
+    affinity), so a domain is only ever fetched by one process and the
+    fetcher's per-domain delay holds across the whole fleet. Leases expire, so
+    a restarted worker picks up rows its predecessor left half-done.
+    session_factory makes AsyncSessions (db.AsyncSessionLocal)."""
+
+    def __init__(self, session_factory, worker_index=0, num_workers=1, num_shards=64, lease_seconds=300, per_domain=4, max_attempts=None):
+        self.session_factory = session_factory
+        self.worker_index = worker_index
+        self.num_workers = num_workers
+        # fixed shard count, so changing the number of workers only changes
+        # which worker owns a shard, not which shard a stored row is in
+        self.num_shards = num_shards
+        self.shards = [s for s in range(self.num_shards) if s % num_workers == worker_index]
+        self.lease_seconds = lease_seconds
+        self.per_domain = per_domain  # most rows of one domain leased at a time
+        self.max_attempts = max_attempts  # rows leased this often without being settled are given up
+        self.owner = worker_name(worker_index)
+
+    def _insert(self, session):
+        return postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert
+
+    async def add(self, urls, priority=0.0, requeue_before=None):
+        """Insert urls, ignoring ones already queued. Rows finished before
+        requeue_before (normally the start of this run) go back to pending so
+        each run recrawls what it discovers. priority is one score for all
+        urls or a list parallel to them. Returns how many were queued."""
+        rows = []
+        for url, prio in zip(urls, _priorities(priority, len(urls))):
+            domain = domain_from_url(url)
+            rows.append({"url": url, "url_key": canonicalize_url(url), "domain": domain,
+                         "shard": shard_for(domain, self.num_shards), "status": "pending",
+                         "priority": prio, "attempts": 0})
+        if not rows:
+            return 0
+        # one row per url_key: a second would make the upsert touch the same row twice
+        rows = list({r["url_key"]: r for r in rows}.values())
+        async with self.session_factory() as session:
+            stmt = self._insert(session)(FrontierUrl).values(rows)
+            if requeue_before is None:
+                stmt = stmt.on_conflict_do_nothing(index_elements=["url_key"])
+            else:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["url_key"],
+                    set_={"status": "pending", "attempts": 0, "next_attempt_at": None, "priority": stmt.excluded.priority},
+                    where=and_(FrontierUrl.status.notin_(["pending", "leased"]),
+                               or_(FrontierUrl.updated_at.is_(None), FrontierUrl.updated_at < requeue_before),
+                               # pages whose sitemap says they haven't changed since are left alone
+                               or_(FrontierUrl.lastmod.is_(None), FrontierUrl.updated_at.is_(None), FrontierUrl.lastmod > FrontierUrl.updated_at)),
+                )
+            res = await session.execute(stmt)
+            await session.commit()
+            return res.rowcount or 0
+
+    async def add_changed(self, entries, priority=0.0):
+        """Insert (url, lastmod) pairs from a sitemap. Known URLs go back to
+        pending only if their lastmod is newer than the one stored (or, for
+        rows without one, than when they were last crawled). Entries without a
+        lastmod go through add() and are requeued once per run as usual."""
+        rows = []
+        for (url, lastmod), prio in zip(entries, _priorities(priority, len(entries))):
+            domain = domain_from_url(url)
+            rows.append({"url": url, "url_key": canonicalize_url(url), "domain": domain,
+                         "shard": shard_for(domain, self.num_shards), "status": "pending",
+                         "priority": prio, "attempts": 0, "lastmod": lastmod})
+        if not rows:
+            return 0
+        # one row per url_key: a second would make the upsert touch the same row twice
+        rows = list({r["url_key"]: r for r in rows}.values())
+        async with self.session_factory() as session:
+            stmt = self._insert(session)(FrontierUrl).values(rows)
+            active = FrontierUrl.status.in_(["pending", "leased"])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["url_key"],
+                # rows already waiting keep their state and just learn the new lastmod
+                set_={"lastmod": stmt.excluded.lastmod,
+                      "status": case((active, FrontierUrl.status), else_="pending"),
+                      "attempts": case((active, FrontierUrl.attempts), else_=0),
+                      "next_attempt_at": case((active, FrontierUrl.next_attempt_at), else_=None),
+                      "priority": stmt.excluded.priority},
+                where=or_(and_(FrontierUrl.lastmod.is_(None), FrontierUrl.updated_at.is_(None)),
+                          stmt.excluded.lastmod > func.coalesce(FrontierUrl.lastmod, FrontierUrl.updated_at)),
+            )
+            res = await session.execute(stmt)
+            await session.commit()
+            return res.rowcount or 0
+
+    async def lease(self, n):
+        """Claim up to n leasable rows for this worker; returns [(id, url, attempts)].
+
+        Best priority first, but no domain gets more than per_domain rows
+        leased at once (rows already out count), so one big site can't fill
+        every batch and leave the workers queued behind its politeness delay."""
+        now = datetime.datetime.utcnow()
+        token = f"{self.owner}:{uuid.uuid4().hex[:8]}"
+        async with self.session_factory() as session:
+            held = and_(FrontierUrl.status == "leased", FrontierUrl.lease_expires_at >= now)
+            leasable = and_(
+                or_(FrontierUrl.status == "pending",
+                    and_(FrontierUrl.status == "leased", FrontierUrl.lease_expires_at < now)),
+                or_(FrontierUrl.next_attempt_at.is_(None), FrontierUrl.next_attempt_at <= now),
+            )
+            if self.max_attempts:
+                # e.g. a page that crashes its worker every time: its lease just expires
+                res = await session.execute(
+                    update(FrontierUrl).where(FrontierUrl.shard.in_(self.shards), leasable,
+                                              FrontierUrl.attempts >= self.max_attempts)
+                    .values(status="failed", lease_owner=None, lease_expires_at=None)
+                    .execution_options(synchronize_session=False))
+                if res.rowcount:
+                    logger.warning("Gave up on %d frontier rows after %d attempts", res.rowcount, self.max_attempts)
+            ranked = select(
+                FrontierUrl.id,
+                case((held, 0), else_=1).label("free"),
+                func.row_number().over(partition_by=FrontierUrl.domain,
+                                       order_by=(case((held, 0), else_=1), FrontierUrl.priority.desc(), FrontierUrl.id)).label("rank"),
+            ).where(FrontierUrl.shard.in_(self.shards), or_(held, leasable)).subquery()
+            capped = select(ranked.c.id).where(ranked.c.free == 1, ranked.c.rank <= self.per_domain)
+            candidates = select(FrontierUrl.id).where(FrontierUrl.id.in_(capped)).order_by(
+                FrontierUrl.priority.desc(), FrontierUrl.id).limit(n)
+            if session.bind.dialect.name == "postgresql":
+                # concurrent leasers skip each other's rows instead of blocking
+                candidates = candidates.with_for_update(skip_locked=True)
+            # a single UPDATE is atomic on SQLite too, which serializes writers
+            await session.execute(
+                update(FrontierUrl).where(FrontierUrl.id.in_(candidates.scalar_subquery()))
+                .values(status="leased", lease_owner=token,
+                        lease_expires_at=now + datetime.timedelta(seconds=self.lease_seconds),
+                        attempts=FrontierUrl.attempts + 1)
+                .execution_options(synchronize_session=False)
+            )
+            rows = (await session.execute(
+                select(FrontierUrl.id, FrontierUrl.url, FrontierUrl.attempts).where(FrontierUrl.lease_owner == token)
+                .order_by(FrontierUrl.priority.desc(), FrontierUrl.id)
+            )).all()
+            await session.commit()
+        return [(r.id, r.url, r.attempts) for r in rows]
+
+    async def complete(self, item_id, status="done"):
+        async with self.session_factory() as session:
+            await session.execute(update(FrontierUrl).where(FrontierUrl.id == item_id)
+                                  .values(status=status, lease_owner=None, lease_expires_at=None))
+            await session.commit()
+
+    async def retry(self, item_id, delay, refund_attempt=False):
+        # back to pending, but not leasable until the delay has passed
+        values = {"status": "pending", "lease_owner": None, "lease_expires_at": None,
+                  "next_attempt_at": datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)}
+        if refund_attempt:
+            values["attempts"] = FrontierUrl.attempts - 1
+        async with self.session_factory() as session:
+            await session.execute(update(FrontierUrl).where(FrontierUrl.id == item_id).values(**values))
+            await session.commit()
+
+    async def reprioritize(self, domain, delta):
+        # shift the score of every waiting row of a domain, e.g. when its yield estimate moves
+        async with self.session_factory() as session:
+            res = await session.execute(update(FrontierUrl).where(FrontierUrl.domain == domain, FrontierUrl.status == "pending")
+                                        .values(priority=FrontierUrl.priority + delta))
+            await session.commit()
+            return res.rowcount or 0
+
+    async def pending_count(self, all_shards=False):
+        async with self.session_factory() as session:
+            q = select(func.count(FrontierUrl.id)).where(FrontierUrl.status.in_(["pending", "leased"]))
+            if not all_shards:
+                q = q.where(FrontierUrl.shard.in_(self.shards))
+            return (await session.execute(q)).scalar() or 0
+
+    async def pending_by_domain(self, domains):
+        # {domain: rows still to crawl}, across all shards
+        async with self.session_factory() as session:
+            q = (select(FrontierUrl.domain, func.count(FrontierUrl.id))
+                 .where(FrontierUrl.domain.in_(list(domains)), FrontierUrl.status.in_(["pending", "leased"]))
+                 .group_by(FrontierUrl.domain))
+            return dict((await session.execute(q)).all())
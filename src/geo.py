@@ -0,0 +1,77 @@
+import math
+
+# Plain geohash implementation; precision 7 cells are ~150m x 150m which is
+# plenty for "resorts near X" style lookups.
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS_KM = 6371.0088
+GEOHASH_PRECISION = 7
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    if lat is None or lon is None:
+        return None
+    lat_rng = [-90.0, 90.0]
+    lon_rng = [-180.0, 180.0]
+    out = []
+    bits = 0
+    ch = 0
+    even = True
+    while len(out) < precision:
+        rng, val = (lon_rng, lon) if even else (lat_rng, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if val >= mid:
+            ch = (ch << 1) | 1
+            rng[0] = mid
+        else:
+            ch = ch << 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_BASE32[ch])
+            bits = 0
+            ch = 0
+    return "".join(out)
+
+def cell_size_deg(precision):
+    # (height, width) in degrees of a cell at the given precision
+    nbits = 5 * precision
+    lon_bits = (nbits + 1) // 2
+    lat_bits = nbits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def bbox_around(lat, lon, radius_km):
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    coslat = math.cos(math.radians(lat))
+    dlon = 180.0 if coslat < 1e-6 else min(180.0, math.degrees(radius_km / (EARTH_RADIUS_KM * coslat)))
+    return (max(-90.0, lat - dlat), max(-180.0, lon - dlon),
+            min(90.0, lat + dlat), min(180.0, lon + dlon))
+
+def _steps(lo, hi, step):
+    n = int(math.floor((hi - lo) / step)) + 1
+    return [lo + i * step for i in range(n)] + [hi]
+
+def geohash_cover(min_lat, min_lon, max_lat, max_lon, max_cells=32):
+    """Geohash prefixes covering a bounding box, using the finest precision
+    that stays under max_cells. Returns [] if even precision 1 is too many."""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        h, w = cell_size_deg(precision)
+        est = (math.ceil((max_lat - min_lat) / h) + 1) * (math.ceil((max_lon - min_lon) / w) + 1)
+        if est > max_cells:
+            continue
+        cells = set()
+        for la in _steps(min_lat, max_lat, h):
+            for lo in _steps(min_lon, max_lon, w):
+                cells.add(geohash_encode(la, lo, precision))
+        return sorted(cells)
+    return []
+
+def prefix_upper_bound(prefix):
+    # geohash alphabet is lowercase ascii, "{" sorts right after "z"
+    return prefix + "{"
@@ -1,12 +1,68 @@
-import logging, sys
+import atexit, logging, logging.handlers, os, queue, random, sys
 
-def setup_logger(name="ski_crawler", level=logging.INFO):
+# pass as extra= on high-volume per-URL log lines so they can be sampled
+PER_URL = {"per_url": True}
+
+_level = logging.getLevelName(os.environ.get("LOG_LEVEL", "INFO").upper())
+_queue = queue.SimpleQueue()
+_listener = None
+_loggers = {}
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # hand the record over untouched; %-formatting happens on the listener thread
+    def prepare(self, record):
+        return record
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not getattr(record, "per_url", False):
+            return True
+        return self.rate >= 1.0 or random.random() < self.rate
+
+_FORMAT = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+_sampler = SamplingFilter()
+_handler = _DeferredQueueHandler(_queue)
+_handler.addFilter(_sampler)
+
+def _start_listener():
+    global _listener
+    if _listener is not None:
+        return
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(_FORMAT)
+    _listener = logging.handlers.QueueListener(_queue, ch)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+def setup_logger(name="ski_crawler", level=None):
     logger = logging.getLogger(name)
-    logger.setLevel(level)
+    logger.setLevel(level if level is not None else _level)
     if not logger.handlers:
-        ch = logging.StreamHandler(sys.stdout)
-        ch.setLevel(level)
-        fmt = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
-        ch.setFormatter(fmt)
-        logger.addHandler(ch)
+        logger.addHandler(_handler)
+    _loggers[name] = logger
+    _start_listener()
     return logger
+
+def configure_logging(level="INFO", per_url_sample_rate=1.0):
+    # applies config.yaml's log_level to every logger created so far and to later ones
+    global _level
+    _level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    _sampler.rate = per_url_sample_rate
+    for lg in _loggers.values():
+        lg.setLevel(_level)
+
+def log_synchronously():
+    # pool workers can be terminated before the listener thread drains the
+    # queue, so they write each record (and flush) in the logging thread
+    global _handler
+    direct = logging.StreamHandler(sys.stdout)
+    direct.setFormatter(_FORMAT)
+    direct.addFilter(_sampler)
+    for lg in _loggers.values():
+        lg.removeHandler(_handler)
+        lg.addHandler(direct)
+    _handler = direct
@@ -1,7 +1,8 @@
-import asyncio, yaml, os
+import argparse, asyncio, multiprocessing, yaml, os
 from db import init_db
 from crawler import Crawler
-from logger_conf import setup_logger
+from logger_conf import setup_logger, configure_logging
+from metrics import metrics
 
 logger = setup_logger("main")
 
@@ -12,17 +13,59 @@ def load_config():
     cfg.setdefault("concurrency", 4)
     cfg.setdefault("per_domain_delay_seconds", [1.0,3.0])
     cfg.setdefault("max_retries", 3)
+    cfg.setdefault("log_level", "INFO")
+    cfg.setdefault("log_sample_rate", 1.0)
+    cfg.setdefault("metrics_json_path", "crawl_metrics.json")
+    cfg.setdefault("metrics_port", None)
     return cfg
 
-async def main():
+async def main(worker_index=0, num_workers=1, discover=True, skip_init=False):
     cfg = load_config()
-    init_db()
+    cfg["worker_index"] = worker_index
+    cfg["num_workers"] = num_workers
+    cfg["discover"] = discover
+    configure_logging(cfg["log_level"], cfg["log_sample_rate"])
+    if not skip_init:
+        init_db()
+    metrics.set_gauge("worker_index", worker_index)
+    prom = await metrics.serve_prometheus(cfg["metrics_port"] + worker_index) if cfg["metrics_port"] else None
     crawler = Crawler(cfg)
     await crawler.start()
     try:
         await crawler.run()
     finally:
         await crawler.stop()
+        if cfg["metrics_json_path"]:
+            path = cfg["metrics_json_path"]
+            if num_workers > 1:
+                root, ext = os.path.splitext(path)
+                path = f"{root}.worker{worker_index}{ext}"
+            metrics.write_json(path)
+        if prom:
+            await prom.cleanup()
+
+def run_worker(worker_index, num_workers, discover):
+    asyncio.run(main(worker_index, num_workers, discover, skip_init=True))
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Ski resort crawler")
+    # for containers across hosts: give each one its own WORKER_INDEX and the same NUM_WORKERS
+    ap.add_argument("--worker-index", type=int, default=int(os.environ.get("WORKER_INDEX", 0)))
+    ap.add_argument("--num-workers", type=int, default=int(os.environ.get("NUM_WORKERS", 1)))
+    ap.add_argument("--spawn", type=int, default=0, help="run this many worker processes on this host")
+    ap.add_argument("--no-discover", action="store_true", help="only crawl what is already in the frontier")
+    return ap.parse_args()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    if args.spawn > 1:
+        init_db()
+        ctx = multiprocessing.get_context("spawn")
+        procs = [ctx.Process(target=run_worker, args=(i, args.spawn, i == 0 and not args.no_discover)) for i in range(args.spawn)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+    else:
+        # by convention worker 0 runs discovery
+        asyncio.run(main(args.worker_index, args.num_workers, args.worker_index == 0 and not args.no_discover))
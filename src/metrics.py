@@ -0,0 +1,134 @@
+import bisect, json, time
+from contextlib import contextmanager
+from logger_conf import setup_logger
+
+logger = setup_logger("metrics")
+
+# seconds; covers a robots.txt cache hit up to a stuck navigation
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# bytes; a bare HTML page up to a fully loaded media-heavy one
+BYTES_BUCKETS = (10e3, 50e3, 100e3, 250e3, 500e3, 1e6, 2.5e6, 5e6, 10e6, 25e6, 50e6)
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, v):
+        self.counts[bisect.bisect_left(self.buckets, v)] += 1
+        self.count += 1
+        self.sum += v
+        self.min = v if self.min is None else min(self.min, v)
+        self.max = v if self.max is None else max(self.max, v)
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        target = q * self.count
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= target:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "sum": round(self.sum, 6),
+                "mean": round(self.sum / self.count, 6) if self.count else None,
+                "min": self.min, "max": self.max,
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99)}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Metrics:
+    """In-process counters, gauges and histograms keyed by name + labels.
+    Everything runs on the event loop, so no locking."""
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started_at = time.time()
+
+    def inc(self, name, n=1, **labels):
+        k = _key(name, labels)
+        self.counters[k] = self.counters.get(k, 0) + n
+
+    def set_gauge(self, name, value, **labels):
+        self.gauges[_key(name, labels)] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        k = _key(name, labels)
+        h = self.histograms.get(k)
+        if h is None:
+            h = self.histograms[k] = Histogram(buckets)
+        h.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def to_dict(self):
+        def rows(d, conv):
+            return [{"name": n, "labels": dict(l), **conv(v)} for (n, l), v in sorted(d.items())]
+        return {
+            "started_at": self.started_at,
+            "elapsed_seconds": round(time.time() - self.started_at, 3),
+            "counters": rows(self.counters, lambda v: {"value": v}),
+            "gauges": rows(self.gauges, lambda v: {"value": v}),
+            "histograms": rows(self.histograms, lambda h: h.summary()),
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        logger.info("Wrote metrics summary to %s", path)
+
+    def to_prometheus(self):
+        out = []
+        for (n, l), v in sorted(self.counters.items()):
+            out.append(f"{n}{_fmt_labels(l)} {v}")
+        for (n, l), v in sorted(self.gauges.items()):
+            out.append(f"{n}{_fmt_labels(l)} {v}")
+        for (n, l), h in sorted(self.histograms.items()):
+            acc = 0
+            for b, c in zip(h.buckets, h.counts):
+                acc += c
+                out.append(f"{n}_bucket{_fmt_labels(l, [('le', b)])} {acc}")
+            out.append(f"{n}_bucket{_fmt_labels(l, [('le', '+Inf')])} {h.count}")
+            out.append(f"{n}_sum{_fmt_labels(l)} {h.sum}")
+            out.append(f"{n}_count{_fmt_labels(l)} {h.count}")
+        return "\n".join(out) + "\n"
+
+    async def serve_prometheus(self, port, host="0.0.0.0"):
+        from aiohttp import web
+        async def handle(request):
+            return web.Response(text=self.to_prometheus(), content_type="text/plain")
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info("Serving Prometheus metrics on %s:%d/metrics", host, port)
+        return runner
+
+# process-wide registry
+metrics = Metrics()
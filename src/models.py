@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Float, Date, DateTime, JSON, Text, Boolean, ForeignKey, func
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, JSON, Text, Boolean, ForeignKey, Index, UniqueConstraint, event, func
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql import expression
+from geo import geohash_encode
 
 Base = declarative_base()
 
@@ -23,9 +24,23 @@ class Resort(Base):
     day_pass_usd = Column(Float)
     season_pass_usd = Column(Float)
     raw = Column(JSON)  # store raw extracted values and provenance
+    geohash = Column(String(12), index=True)  # derived from lat/lon, see _sync_geohash
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, onupdate=func.now())
 
+    __table_args__ = (
+        Index("ix_resorts_country_continent_price", "country", "continent", "day_pass_usd"),
+        Index("ix_resorts_continent_price", "continent", "day_pass_usd"),
+        Index("ix_resorts_season", "opening_date", "closing_date"),
+        Index("ix_resorts_lat_lon", "lat", "lon"),
+    )
+
+@event.listens_for(Resort, "before_insert")
+@event.listens_for(Resort, "before_update")
+def _sync_geohash(mapper, connection, target):
+    # keep the precomputed cell in step with lat/lon on every write
+    target.geohash = geohash_encode(target.lat, target.lon)
+
 class RawPage(Base):
     __tablename__ = "raw_pages"
     id = Column(Integer, primary_key=True)
@@ -46,6 +61,7 @@ class ExtractionPattern(Base):
     created_at = Column(DateTime, server_default=func.now())
 
 class ExtractionLog(Base):
+    # legacy one-row-per-field log; new runs write PageExtraction instead
     __tablename__ = "extraction_logs"
     id = Column(Integer, primary_key=True)
     url = Column(String, index=True)
@@ -54,3 +70,104 @@ class ExtractionLog(Base):
     method = Column(String)  # regex/spacy/pattern_bank
     confidence = Column(Float)
     timestamp = Column(DateTime, server_default=func.now())
+
+class PageExtraction(Base):
+    # provenance of one page in one run; fields packs every field, see provenance.pack_fields
+    __tablename__ = "page_extractions"
+    id = Column(Integer, primary_key=True)
+    url = Column(String, index=True)
+    domain = Column(String)
+    run_id = Column(String(32))
+    fields = Column(JSON)  # field -> [tier, value, confidence, pattern_id, template_id, ms]
+    total_ms = Column(Float)
+    created_at = Column(DateTime, server_default=func.now(), index=True)
+
+    __table_args__ = (
+        Index("ix_page_extractions_domain_created", "domain", "created_at"),
+    )
+
+class ExtractionRollup(Base):
+    # daily per-domain/per-field counters; kept after the PageExtraction detail is pruned
+    __tablename__ = "extraction_rollups"
+    id = Column(Integer, primary_key=True)
+    day = Column(Date)
+    domain = Column(String)
+    field = Column(String)
+    pages = Column(Integer, default=0)
+    hits = Column(Integer, default=0)
+    structured_hits = Column(Integer, default=0)
+    template_hits = Column(Integer, default=0)
+    regex_hits = Column(Integer, default=0)
+    spacy_hits = Column(Integer, default=0)
+    auto_pattern_hits = Column(Integer, default=0)
+    total_ms = Column(Float, default=0.0)
+    max_ms = Column(Float, default=0.0)
+
+    __table_args__ = (
+        UniqueConstraint("day", "domain", "field", name="uq_extraction_rollups_day_domain_field"),
+        Index("ix_extraction_rollups_domain_field", "domain", "field"),
+    )
+
+class ResortXref(Base):
+    # cross-source identity: every row sharing an entity_id is the same resort
+    __tablename__ = "resort_xrefs"
+    id = Column(Integer, primary_key=True)
+    entity_id = Column(String(32), index=True)
+    source = Column(String)      # crawler / skiresort.info
+    source_key = Column(String)  # Resort.url or skiresort.info link
+    resort_id = Column(Integer, ForeignKey("resorts.id"), nullable=True)
+    name = Column(String)
+    score = Column(Float)
+    method = Column(String)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("source", "source_key", name="uq_resort_xrefs_source_key"),
+    )
+
+class FrontierUrl(Base):
+    # shared crawl frontier; workers lease rows from the shards they own
+    __tablename__ = "frontier"
+    id = Column(Integer, primary_key=True)
+    url = Column(String)
+    url_key = Column(String, unique=True)  # canonicalize_url(url)
+    domain = Column(String, index=True)
+    shard = Column(Integer)
+    status = Column(String, default="pending")  # pending / leased / done / failed / blocked / duplicate
+    priority = Column(Float, default=0.0)
+    attempts = Column(Integer, default=0)
+    lease_owner = Column(String)
+    lease_expires_at = Column(DateTime)
+    next_attempt_at = Column(DateTime)
+    lastmod = Column(DateTime)  # from the site's sitemap, when it gave one
+    discovered_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_frontier_lease", "shard", "status", "priority"),
+    )
+
+class SelectorTemplate(Base):
+    # DOM-level counterpart of ExtractionPattern: where a field lives on a given site
+    __tablename__ = "selector_templates"
+    id = Column(Integer, primary_key=True)
+    domain = Column(String, index=True)
+    field = Column(String)
+    selector = Column(String)  # CSS selector, see wrapper_induction.css_path
+    hits = Column(Integer, default=0)
+    misses = Column(Integer, default=0)
+    confidence = Column(Float, default=0.7)
+    created_at = Column(DateTime, server_default=func.now())
+    last_hit_at = Column(DateTime)
+
+    __table_args__ = (
+        UniqueConstraint("domain", "field", "selector", name="uq_selector_templates_domain_field_selector"),
+    )
+
+class ReadinessProfile(Base):
+    # learned per-domain readiness strategy, see readiness.ReadinessProfiles
+    __tablename__ = "readiness_profiles"
+    id = Column(Integer, primary_key=True)
+    domain = Column(String, unique=True)
+    strategy = Column(String)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,66 @@
+import hashlib, re
+import numpy as np
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+def _h64(s):
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+
+MIN_TOKENS = 50
+
+def simhash(text, shingle=3, max_tokens=20000, min_tokens=MIN_TOKENS):
+    # 64-bit SimHash over word shingles of the page text; None when the page has
+    # too little text for its fingerprint to say anything (JS shells, title-only pages)
+    tokens = _TOKEN.findall(text.lower())[:max_tokens]
+    if len(tokens) < max(min_tokens, shingle):
+        return None
+    n = len(tokens) - shingle + 1
+    hashes = np.fromiter((_h64(" ".join(tokens[i:i + shingle])) for i in range(n)), dtype=np.uint64, count=n)
+    # per-bit majority vote across shingle hashes
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(n, 8), axis=1)
+    majority = (bits.sum(axis=0) * 2 > n).astype(np.uint8)
+    return int(np.packbits(majority).view(">u8")[0])
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class NearDuplicateIndex:
+    """SimHash index. Fingerprints are split into bands; by pigeonhole any two
+    fingerprints within max_distance bits agree exactly on at least one band
+    as long as bands > max_distance, so lookups only compare band collisions."""
+
+    def __init__(self, max_distance=3, bands=4, min_tokens=MIN_TOKENS):
+        assert bands > max_distance and 64 % bands == 0
+        self.max_distance = max_distance
+        self.min_tokens = min_tokens
+        self.bands = bands
+        self.band_bits = 64 // bands
+        self.tables = [{} for _ in range(bands)]
+        self.size = 0
+
+    def _band_keys(self, fp):
+        mask = (1 << self.band_bits) - 1
+        return [(fp >> (i * self.band_bits)) & mask for i in range(self.bands)]
+
+    def find(self, fp):
+        # returns the url of a near-duplicate already in the index, or None
+        for table, key in zip(self.tables, self._band_keys(fp)):
+            for other_fp, url in table.get(key, ()):
+                if hamming(fp, other_fp) <= self.max_distance:
+                    return url
+        return None
+
+    def add(self, fp, url):
+        for table, key in zip(self.tables, self._band_keys(fp)):
+            table.setdefault(key, []).append((fp, url))
+        self.size += 1
+
+    def check_and_add(self, text, url):
+        fp = simhash(text, min_tokens=self.min_tokens)
+        if fp is None:
+            return None, None
+        dup = self.find(fp)
+        if dup is None:
+            self.add(fp, url)
+        return fp, dup
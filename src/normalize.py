@@ -0,0 +1,63 @@
+import datetime
+
+# extractor field -> Resort columns it fills
+FIELD_COLUMNS = {
+    "name": ["name"],
+    "country": ["country"],
+    "continent": ["continent"],
+    "lat": ["lat"],
+    "lon": ["lon"],
+    "snowfall": ["snowfall_inches"],
+    "opening_date": ["opening_date"],
+    "closing_date": ["closing_date"],
+    "num_lifts": ["num_lifts"],
+    "runs_breakdown": ["runs_easy", "runs_intermediate", "runs_advanced"],
+    "day_pass_price": ["day_pass_usd"],
+    "season_pass_price": ["season_pass_usd"],
+}
+
+def normalize_to_resort(url, extracted):
+    if not extracted:
+        return None
+
+    def safe(v, for_json=False):
+        if v is None:
+            return None
+        val = v.get('value') if isinstance(v, dict) else v
+        if isinstance(val, (datetime.date, datetime.datetime)):
+            if for_json:
+                return val.isoformat()   # for JSON storage
+            return val.date() if isinstance(val, datetime.datetime) else val  # for Date columns
+        return val
+
+    runs = safe(extracted.get('runs_breakdown'))
+    return {
+        "name": safe(extracted.get('name')),
+        "url": url,
+        "country": safe(extracted.get('country')),
+        "continent": safe(extracted.get('continent')),
+        "lat": safe(extracted.get('lat')),
+        "lon": safe(extracted.get('lon')),
+        "snowfall_inches": safe(extracted.get('snowfall')),
+        "opening_date": safe(extracted.get('opening_date')),   # keep as date
+        "closing_date": safe(extracted.get('closing_date')),   # keep as date
+        "num_lifts": safe(extracted.get('num_lifts')),
+        "runs_easy": runs.get('easy') if runs else None,
+        "runs_intermediate": runs.get('intermediate') if runs else None,
+        "runs_advanced": runs.get('advanced') if runs else None,
+        "day_pass_usd": safe(extracted.get('day_pass_price')),
+        "season_pass_usd": safe(extracted.get('season_pass_price')),
+        # convert values to JSON-safe for the raw column
+        "raw": {k: safe(v, for_json=True) for k, v in extracted.items()}
+    }
+
+def apply_resort_fields(existing, resort, fields=None):
+    # update fields if present; fields limits which columns may change
+    changed = {}
+    for k, v in resort.items():
+        if v is None or k == "url" or (fields is not None and k not in fields):
+            continue
+        if getattr(existing, k) != v:
+            changed[k] = (getattr(existing, k), v)
+            setattr(existing, k, v)
+    return changed
@@ -1,16 +1,45 @@
+import asyncio, time
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import ExtractionPattern
 from logger_conf import setup_logger
 logger = setup_logger("pattern_bank")
 
 class PatternBank:
-    def __init__(self, session):
+    """Learned extraction patterns. With a plain Session every call goes to
+    the database. With an AsyncSession (the crawler) reads come from a cache
+    that refresh() reloads, and new patterns wait in memory until save(), so
+    the synchronous extraction code never touches the database."""
+
+    def __init__(self, session, refresh_seconds=300, lock=None):
         self.session = session
+        self.is_async = isinstance(session, AsyncSession)
+        self.refresh_seconds = refresh_seconds  # picks up patterns other workers learned
+        self._by_field = {}  # field -> [ExtractionPattern], async mode only
+        self._loaded_at = None
+        self._pending = []
+        self._lock = lock or asyncio.Lock()  # share it with anything else using the same AsyncSession
 
     def get_patterns(self, field):
-        rows = self.session.query(ExtractionPattern).filter(ExtractionPattern.field==field).order_by(ExtractionPattern.confidence.desc()).all()
-        return [r.pattern_text for r in rows]
+        return [text for _, text in self.get_pattern_rows(field)]
+
+    def get_pattern_rows(self, field):
+        # (id, pattern_text), best first; the id is kept as extraction provenance
+        if self.is_async:
+            return [(p.id, p.pattern_text) for p in self._by_field.get(field, [])]
+        rows = self.session.query(ExtractionPattern.id, ExtractionPattern.pattern_text).filter(ExtractionPattern.field==field).order_by(ExtractionPattern.confidence.desc()).all()
+        return [(r.id, r.pattern_text) for r in rows]
 
     def add_pattern(self, field, pattern_text, source="auto", confidence=0.5):
+        if self.is_async:
+            exists = next((p for p in self._by_field.get(field, []) if p.pattern_text == pattern_text), None)
+            if exists:
+                return exists
+            p = ExtractionPattern(field=field, pattern_text=pattern_text, source=source, confidence=confidence)
+            self._by_field.setdefault(field, []).append(p)
+            self._pending.append(p)
+            return p
         # avoid duplicates
         exists = self.session.query(ExtractionPattern).filter(ExtractionPattern.field==field, ExtractionPattern.pattern_text==pattern_text).first()
         if exists:
@@ -20,3 +49,43 @@ class PatternBank:
         self.session.commit()
         logger.info("Added pattern for %s: %s", field, pattern_text)
         return p
+
+    def _fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_seconds
+
+    async def refresh(self, force=False):
+        if not force and self._fresh():
+            return
+        async with self._lock:
+            if not force and self._fresh():  # another task refreshed while we waited
+                return
+            res = await self.session.execute(select(ExtractionPattern).order_by(ExtractionPattern.confidence.desc()))
+            by_field = {}
+            for p in res.scalars():
+                by_field.setdefault(p.field, []).append(p)
+            for p in self._pending:  # learned here, not written yet
+                by_field.setdefault(p.field, []).append(p)
+            self._by_field = by_field
+            self._loaded_at = time.monotonic()
+
+    async def save(self):
+        # False if the write failed; the session was rolled back, see reset()
+        if not self._pending:
+            return True
+        async with self._lock:
+            pending, self._pending = self._pending, []
+            self.session.add_all(pending)
+            try:
+                await self.session.commit()
+            except SQLAlchemyError as e:
+                await self.session.rollback()
+                logger.warning("Dropped %d learned patterns: %s", len(pending), e)
+                return False
+        for p in pending:
+            logger.info("Added pattern for %s: %s", p.field, p.pattern_text)
+        return True
+
+    def reset(self):
+        # a rollback expires the cached rows, which async code can't reload lazily
+        self._by_field = {}
+        self._loaded_at = None
@@ -0,0 +1,112 @@
+import re
+from collections import defaultdict
+from urllib.parse import urlparse
+from sqlalchemy import func, select
+from models import ExtractionRollup, Resort
+from normalize import FIELD_COLUMNS
+from utils import domain_from_url, source_type
+from logger_conf import setup_logger
+from metrics import metrics
+
+logger = setup_logger("prioritizer")
+
+# path/anchor categories, checked in order, with the share of fields a page of
+# that kind was assumed to fill before any results came in
+CATEGORIES = (
+    ("low", r"blog|news|press|events?\b|jobs|careers|employment|privacy|terms|legal|cookie|login|cart|checkout|shop|store|wedding|real-estate|gallery", 0.05),
+    ("tickets", r"ticket|pass(?:es)?\b|pric|rates", 0.5),
+    ("snow", r"snow|condition|report|weather", 0.45),
+    ("trails", r"trail|piste|runs?\b|terrain|trail-?map|lifts?\b", 0.45),
+    ("mountain", r"mountain|stats|facts|about|info|overview", 0.45),
+    ("season", r"season|hours|opening|operat|calendar", 0.4),
+    ("location", r"location|getting-here|direction|contact|travel", 0.3),
+)
+_CATEGORY_RES = [(name, re.compile(p, re.I), prior) for name, p, prior in CATEGORIES]
+HOME_PRIOR, OTHER_PRIOR = 0.5, 0.2
+SOURCE_BONUS = {"official": 0.15, "aggregator": 0.05, "social": -0.3}
+VIA_BONUS = {"seed": 0.1, "sitemap": 0.05, "official_link": 0.05}
+DEFAULT_YIELD = 0.3  # share of fields filled per page on a domain we know nothing about
+
+def category(url, anchor=None):
+    path = urlparse(url).path or "/"
+    if path.strip("/") == "":
+        return "home"
+    for name, rx, _ in _CATEGORY_RES:
+        if rx.search(path):
+            return name
+    if anchor:
+        for name, rx, _ in _CATEGORY_RES:
+            if rx.search(anchor):
+                return name
+    return "other"
+
+
+class Prioritizer:
+    """Expected-value score for a frontier URL, higher is fetched sooner.
+
+    score = what pages of the URL's category have filled so far (path first,
+    anchor text as a fallback) + how productive its domain has been + a bonus
+    for official sites and sitemap/seed sources - a small depth penalty.
+    Category and domain yields start from priors and the crawl history
+    (ExtractionRollup, Resort) and move with every extracted page; when a
+    domain's yield moves, its pending frontier rows are re-scored too."""
+
+    def __init__(self, session_factory, category_weight=0.45, domain_weight=0.35, alpha=0.1, resync_delta=0.02):
+        self.session_factory = session_factory
+        self.category_weight = category_weight
+        self.domain_weight = domain_weight
+        self.alpha = alpha  # EMA step for online updates
+        self.resync_delta = resync_delta
+        self.category_yield = {name: prior for name, _, prior in CATEGORIES}
+        self.category_yield.update(home=HOME_PRIOR, other=OTHER_PRIOR)
+        self.domain_yield = {}
+        self.synced = {}  # domain -> yield last written into its pending frontier rows
+
+    async def load_history(self):
+        """Domain yields from past runs: field hit rate from the extraction
+        rollups, else how complete the domain's Resort rows are."""
+        async with self.session_factory() as session:
+            q = select(ExtractionRollup.domain, func.sum(ExtractionRollup.hits), func.sum(ExtractionRollup.pages)).group_by(ExtractionRollup.domain)
+            for domain, hits, pages in await session.execute(q):
+                if pages:
+                    self.domain_yield[domain] = hits / pages
+            columns = [c for cols in FIELD_COLUMNS.values() for c in cols]
+            filled = defaultdict(list)
+            for row in await session.execute(select(Resort.url, *[getattr(Resort, c) for c in columns])):
+                domain = domain_from_url(row[0])
+                if domain not in self.domain_yield:
+                    filled[domain].append(sum(v is not None for v in row[1:]) / len(columns))
+            for domain, fracs in filled.items():
+                self.domain_yield[domain] = sum(fracs) / len(fracs)
+        self.synced = dict(self.domain_yield)
+        logger.info("Loaded extraction yield for %d domains", len(self.domain_yield))
+
+    def yield_of(self, domain):
+        return self.domain_yield.get(domain, DEFAULT_YIELD)
+
+    def score(self, url, anchor=None, via=None):
+        domain = domain_from_url(url)
+        depth = len([p for p in (urlparse(url).path or "").split("/") if p])
+        s = (self.category_weight * self.category_yield[category(url, anchor)]
+             + self.domain_weight * self.yield_of(domain)
+             + SOURCE_BONUS[source_type(domain or "")]
+             + VIA_BONUS.get(via, 0.0)
+             - 0.03 * max(0, depth - 2))
+        return round(s, 4)
+
+    def observe(self, url, filled):
+        """Feed back the share of fields a fetched page filled. Returns
+        (domain, priority delta) when the domain's pending rows should be
+        re-scored, else None."""
+        domain = domain_from_url(url)
+        cat = category(url)
+        self.category_yield[cat] += self.alpha * (filled - self.category_yield[cat])
+        old = self.yield_of(domain)
+        new = old + 2 * self.alpha * (filled - old)  # domains move faster: each has far fewer pages
+        self.domain_yield[domain] = new
+        metrics.set_gauge("category_yield", round(self.category_yield[cat], 3), category=cat)
+        synced = self.synced.get(domain, DEFAULT_YIELD)
+        if abs(new - synced) < self.resync_delta:
+            return None
+        self.synced[domain] = new
+        return domain, self.domain_weight * (new - synced)
@@ -0,0 +1,169 @@
+import argparse, datetime, os, uuid
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from models import PageExtraction, ExtractionRollup, ExtractionLog
+from logger_conf import setup_logger
+from metrics import metrics
+
+logger = setup_logger("provenance")
+
+TIERS = ("structured", "template", "regex", "spacy", "auto_pattern")
+VALUE_MAX_LEN = 200
+
+def _value(v):
+    if v is None:
+        return None
+    if isinstance(v, (datetime.date, datetime.datetime)):
+        return v.isoformat()
+    if isinstance(v, (int, float, bool)):
+        return v
+    return str(v)[:VALUE_MAX_LEN]
+
+def pack_fields(extracted, timings=None):
+    """One compact record per field: [tier, value, confidence, pattern_id,
+    template_id, ms]. Misses are kept as tier "none" so hit rates and their
+    cost can be computed from the detail too."""
+    timings = timings or {}
+    packed = {}
+    for field in set(extracted) | set(timings):
+        hit = extracted.get(field)
+        ms = round(timings[field], 2) if field in timings else None
+        if not hit:
+            packed[field] = ["none", None, None, None, None, ms]
+            continue
+        conf = hit.get("confidence")
+        packed[field] = [hit.get("tier", "unknown"), _value(hit.get("value")), round(conf, 3) if conf is not None else None,
+                         hit.get("pattern_id"), hit.get("template_id"), ms]
+    return packed
+
+def new_run_id():
+    return uuid.uuid4().hex
+
+
+class ProvenanceWriter:
+    """Writes one PageExtraction row per page and keeps the daily
+    ExtractionRollup counters. Detail rows ride on the caller's next commit;
+    rollup deltas are summed in memory and upserted additively, so several
+    workers can share a day's row. With a session, flush() runs every
+    flush_every pages by itself; without one the owner awaits save() when
+    due is set."""
+
+    def __init__(self, session=None, run_id=None, flush_every=50):
+        self.session = session
+        self.run_id = run_id or new_run_id()
+        self.flush_every = flush_every
+        self._pending = {}  # (day, domain, field) -> counters
+        self._pages = 0
+
+    def record(self, url, domain, extracted, timings=None, total_ms=None, session=None):
+        packed = pack_fields(extracted, timings)
+        (session or self.session).add(PageExtraction(url=url, domain=domain, run_id=self.run_id, fields=packed,
+                                                     total_ms=round(total_ms, 2) if total_ms is not None else None))
+        day = datetime.date.today()
+        for field, (tier, _, _, _, _, ms) in packed.items():
+            c = self._pending.get((day, domain, field))
+            if c is None:
+                c = self._pending[(day, domain, field)] = dict({f"{t}_hits": 0 for t in TIERS}, pages=0, hits=0, total_ms=0.0, max_ms=0.0)
+            c["pages"] += 1
+            if tier != "none":
+                c["hits"] += 1
+                if tier in TIERS:
+                    c[f"{tier}_hits"] += 1
+            if ms is not None:
+                c["total_ms"] += ms
+                c["max_ms"] = max(c["max_ms"], ms)
+        self._pages += 1
+        if self.session is not None and self.due:
+            self.flush()
+
+    @property
+    def due(self):
+        return self._pages >= self.flush_every
+
+    def _take_upsert(self, dialect_name):
+        # the pending rollup deltas as one upsert statement; clears them
+        rows = [dict(c, day=day, domain=domain, field=field) for (day, domain, field), c in self._pending.items()]
+        self._pending = {}
+        self._pages = 0
+        postgres = dialect_name == "postgresql"
+        insert = postgresql.insert if postgres else sqlite.insert
+        greatest = func.greatest if postgres else func.max  # sqlite's two-argument max() is scalar
+        stmt = insert(ExtractionRollup).values(rows)
+        counters = ["pages", "hits", "total_ms"] + [f"{t}_hits" for t in TIERS]
+        set_ = {c: getattr(ExtractionRollup, c) + getattr(stmt.excluded, c) for c in counters}
+        set_["max_ms"] = greatest(ExtractionRollup.max_ms, stmt.excluded.max_ms)
+        return stmt.on_conflict_do_update(index_elements=["day", "domain", "field"], set_=set_), len(rows)
+
+    def flush(self):
+        if not self._pending:
+            return 0
+        stmt, n = self._take_upsert(self.session.bind.dialect.name)
+        with metrics.timer("db_flush_seconds", op="extraction_rollup"):
+            self.session.execute(stmt)
+            self.session.commit()
+        return n
+
+    async def save(self, session):
+        if not self._pending:
+            return 0
+        stmt, n = self._take_upsert(session.bind.dialect.name)
+        with metrics.timer("db_flush_seconds", op="extraction_rollup"):
+            await session.execute(stmt)
+            await session.commit()
+        return n
+
+
+def prune(session, keep_days=30, batch_size=5000):
+    """Delete per-page provenance (and the legacy per-field log) older than
+    keep_days. Rollups are kept. Returns the number of rows removed."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=keep_days)
+    removed = 0
+    for model, ts in ((PageExtraction, PageExtraction.created_at), (ExtractionLog, ExtractionLog.timestamp)):
+        while True:
+            # batched so a large backlog doesn't hold one long write lock
+            ids = select(model.id).where(ts < cutoff).limit(batch_size).scalar_subquery()
+            n = session.execute(delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False)).rowcount or 0
+            session.commit()
+            removed += n
+            if n < batch_size:
+                break
+    if removed:
+        logger.info("Pruned %d provenance rows older than %d days", removed, keep_days)
+    return removed
+
+def field_hit_rates(session, since=None, domain=None):
+    """[(domain, field, pages, hit_rate, avg_ms, max_ms, {tier: hits})] from the rollups."""
+    cols = [func.sum(getattr(ExtractionRollup, f"{t}_hits")) for t in TIERS]
+    q = select(ExtractionRollup.domain, ExtractionRollup.field, func.sum(ExtractionRollup.pages), func.sum(ExtractionRollup.hits),
+               func.sum(ExtractionRollup.total_ms), func.max(ExtractionRollup.max_ms), *cols).group_by(
+               ExtractionRollup.domain, ExtractionRollup.field).order_by(ExtractionRollup.domain, ExtractionRollup.field)
+    if since:
+        q = q.where(ExtractionRollup.day >= since)
+    if domain:
+        q = q.where(ExtractionRollup.domain == domain)
+    out = []
+    for d, f, pages, hits, total_ms, max_ms, *tiers in session.execute(q):
+        pages = pages or 0
+        out.append((d, f, pages, (hits or 0) / pages if pages else 0.0, (total_ms or 0.0) / pages if pages else 0.0,
+                    max_ms or 0.0, dict(zip(TIERS, (t or 0 for t in tiers)))))
+    return out
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Extraction hit rates from the rollups, and provenance retention")
+    ap.add_argument("--domain")
+    ap.add_argument("--since", type=datetime.date.fromisoformat, help="YYYY-MM-DD")
+    ap.add_argument("--prune", type=int, metavar="DAYS", help="delete per-page provenance older than DAYS")
+    return ap.parse_args()
+
+if __name__ == "__main__":
+    from db import SessionLocal, init_db
+    from logger_conf import configure_logging
+    args = parse_args()
+    configure_logging(os.environ.get("LOG_LEVEL", "INFO"))
+    init_db()
+    with SessionLocal() as session:
+        if args.prune is not None:
+            prune(session, args.prune)
+        for d, f, pages, rate, avg_ms, max_ms, tiers in field_hit_rates(session, args.since, args.domain):
+            by_tier = " ".join(f"{t}={n}" for t, n in tiers.items() if n)
+            print(f"{d}\t{f}\t{pages}\t{rate:.1%}\t{avg_ms:.1f}ms\t{max_ms:.1f}ms\t{by_tier}")
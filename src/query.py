@@ -0,0 +1,163 @@
+import time
+from collections import OrderedDict
+from sqlalchemy import and_, or_, event
+from models import Resort
+from geo import geohash_cover, prefix_upper_bound, bbox_around, haversine_km
+from logger_conf import setup_logger
+
+logger = setup_logger("query")
+
+RESULT_COLUMNS = ("id", "name", "url", "country", "continent", "lat", "lon", "snowfall_inches",
+                  "opening_date", "closing_date", "num_lifts", "day_pass_usd", "season_pass_usd")
+
+# Bumped on every Resort write made in this process; cached results from an
+# older generation are discarded.
+_generation = 0
+
+@event.listens_for(Resort, "after_insert")
+@event.listens_for(Resort, "after_update")
+@event.listens_for(Resort, "after_delete")
+def _invalidate(mapper, connection, target):
+    global _generation
+    _generation += 1
+
+
+class LRUCache:
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl  # bounds staleness from writes made by other processes
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        gen, expires, value = entry
+        if gen != _generation or expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._data[key] = (_generation, time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+
+def _shift_years(day, years):
+    try:
+        return day.replace(year=day.year + years)
+    except ValueError:  # Feb 29
+        return day.replace(year=day.year + years, day=28)
+
+def _row_to_dict(r):
+    return {c: getattr(r, c) for c in RESULT_COLUMNS}
+
+
+class ResortQuery:
+    """Read path over the resorts table. Results are plain dicts so they can
+    be cached and handed around without an open session."""
+
+    def __init__(self, session, cache_size=256, cache_ttl=300, max_cells=32):
+        self.session = session
+        self.cache = LRUCache(cache_size, cache_ttl)
+        self.max_cells = max_cells
+
+    def _cached(self, key, fn):
+        out = self.cache.get(key)
+        if out is None:
+            out = fn()
+            self.cache.put(key, out)
+        return out
+
+    def _filters(self, country=None, continent=None, max_day_pass=None, open_on=None):
+        conds = []
+        if country:
+            conds.append(Resort.country == country)
+        if continent:
+            conds.append(Resort.continent == continent)
+        if max_day_pass is not None:
+            conds.append(Resort.day_pass_usd <= max_day_pass)
+        if open_on is not None:
+            conds.append(self._open_on_clause(open_on))
+        return conds
+
+    @staticmethod
+    def _open_on_clause(day):
+        # seasons parsed without a year can come out with closing < opening
+        # (e.g. Nov 20 - Apr 10); treat those as wrapping the new year, i.e.
+        # open from opening to closing a year later, or from opening a year
+        # earlier to closing
+        year_before, year_after = _shift_years(day, -1), _shift_years(day, 1)
+        return or_(
+            and_(Resort.opening_date <= Resort.closing_date,
+                 Resort.opening_date <= day, Resort.closing_date >= day),
+            and_(Resort.opening_date > Resort.closing_date,
+                 or_(and_(Resort.opening_date <= day, Resort.closing_date >= year_before),
+                     and_(Resort.opening_date <= year_after, Resort.closing_date >= day))),
+        )
+
+    def _geo_clause(self, min_lat, min_lon, max_lat, max_lon):
+        conds = [Resort.lat.between(min_lat, max_lat), Resort.lon.between(min_lon, max_lon)]
+        cells = geohash_cover(min_lat, min_lon, max_lat, max_lon, self.max_cells)
+        if cells:
+            # range scans on the geohash index instead of a full lat/lon scan
+            conds.append(or_(*[and_(Resort.geohash >= c, Resort.geohash < prefix_upper_bound(c)) for c in cells]))
+        return and_(*conds)
+
+    def bounding_box(self, min_lat, min_lon, max_lat, max_lon, limit=None, **filters):
+        key = ("bbox", min_lat, min_lon, max_lat, max_lon, limit, tuple(sorted(filters.items())))
+        def run():
+            q = self.session.query(Resort).filter(self._geo_clause(min_lat, min_lon, max_lat, max_lon),
+                                                  *self._filters(**filters))
+            if limit:
+                q = q.limit(limit)
+            return [_row_to_dict(r) for r in q.all()]
+        return self._cached(key, run)
+
+    def within_radius(self, lat, lon, radius_km, limit=None, **filters):
+        key = ("radius", lat, lon, radius_km, limit, tuple(sorted(filters.items())))
+        def run():
+            min_lat, min_lon, max_lat, max_lon = bbox_around(lat, lon, radius_km)
+            q = self.session.query(Resort).filter(self._geo_clause(min_lat, min_lon, max_lat, max_lon),
+                                                  *self._filters(**filters))
+            out = []
+            for r in q.all():
+                d = haversine_km(lat, lon, r.lat, r.lon)
+                if d <= radius_km:
+                    row = _row_to_dict(r)
+                    row["distance_km"] = round(d, 3)
+                    out.append(row)
+            out.sort(key=lambda x: x["distance_km"])
+            return out[:limit] if limit else out
+        return self._cached(key, run)
+
+    def open_on(self, day, limit=None, **filters):
+        key = ("open_on", day, limit, tuple(sorted(filters.items())))
+        def run():
+            q = self.session.query(Resort).filter(*self._filters(open_on=day, **filters))
+            q = q.order_by(Resort.day_pass_usd)
+            if limit:
+                q = q.limit(limit)
+            return [_row_to_dict(r) for r in q.all()]
+        return self._cached(key, run)
+
+    def by_location(self, country=None, continent=None, max_day_pass=None, limit=None):
+        key = ("location", country, continent, max_day_pass, limit)
+        def run():
+            q = self.session.query(Resort).filter(*self._filters(country, continent, max_day_pass))
+            q = q.order_by(Resort.day_pass_usd)
+            if limit:
+                q = q.limit(limit)
+            return [_row_to_dict(r) for r in q.all()]
+        return self._cached(key, run)
@@ -0,0 +1,179 @@
+import asyncio, time
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from models import ReadinessProfile
+from logger_conf import setup_logger
+from metrics import metrics
+
+logger = setup_logger("readiness")
+
+# cheapest first; each step in the ladder waits on top of the previous one
+STRATEGIES = ("dcl_cap", "keywords", "dom_stable", "networkidle")
+
+# text that means the resort data we extract has rendered
+FIELD_KEYWORDS = r"snowfall|lifts?\b|lift ticket|day pass|season pass|trails?\b|runs\b|opening day|season (?:opens|starts)"
+
+_DOM_STABLE_JS = """([quietMs, maxMs]) => new Promise(resolve => {
+    let quiet = setTimeout(done, quietMs);
+    const hard = setTimeout(done, maxMs);
+    const obs = new MutationObserver(() => { clearTimeout(quiet); quiet = setTimeout(done, quietMs); });
+    function done() { obs.disconnect(); clearTimeout(quiet); clearTimeout(hard); resolve(true); }
+    obs.observe(document.documentElement, {childList: true, subtree: true, characterData: true});
+})"""
+
+_KEYWORDS_JS = """(pattern) => new RegExp(pattern, "i").test(document.body ? document.body.innerText : "")"""
+
+
+async def wait_for(page, strategy, cfg, cap_ms=None):
+    """Run one readiness strategy on a page that has reached domcontentloaded.
+    Timeouts are not errors here: whatever has rendered by then is used.
+    cap_ms, if given, bounds the wait below the configured timeout."""
+    def limit(key, default):
+        ms = cfg.get(key, default)
+        return ms if cap_ms is None else max(1, min(ms, int(cap_ms)))
+    try:
+        if strategy == "dcl_cap":
+            await page.wait_for_load_state("load", timeout=limit("load_cap_ms", 1500))
+        elif strategy == "keywords":
+            await page.wait_for_function(_KEYWORDS_JS, arg=FIELD_KEYWORDS, timeout=limit("keyword_timeout_ms", 3000))
+        elif strategy == "dom_stable":
+            await page.evaluate(_DOM_STABLE_JS, [cfg.get("dom_quiet_ms", 500), limit("dom_stable_max_ms", 4000)])
+        elif strategy == "networkidle":
+            await page.wait_for_load_state("networkidle", timeout=limit("networkidle_timeout_ms", 10000))
+        return True
+    except Exception as e:
+        metrics.inc("readiness_timeouts_total", strategy=strategy)
+        logger.debug("Readiness %s gave up: %s", strategy, e)
+        return False
+
+
+class _Profile:
+    def __init__(self):
+        self.strategy = None     # learned strategy, None while calibrating
+        self.votes = []          # cheapest equivalent strategy per calibration page
+        self.pages_since = 0
+
+
+class ReadinessProfiles:
+    """Learns, per domain, the cheapest readiness strategy whose page gives
+    the same extraction signature as the reference (most expensive) one.
+
+    Calibration pages walk the ladder, within calibration_budget_ms in all,
+    and snapshot the HTML after each step; signature_fn (the extractor's
+    cheap regex tier) decides which snapshots are equivalent to the last.
+    After calibration_pages pages the most demanding vote wins, and the
+    domain is re-checked every recheck_every pages in case the site changes.
+
+    Calibrating only pays off on domains with pages left to crawl, so a
+    domain without a profile is calibrated only once the frontier reports
+    at least min_pages of its URLs (see expect()); others get
+    default_strategy. Profiles are stored in the database (load/save) so
+    runs and workers don't recalibrate domains already known."""
+
+    def __init__(self, signature_fn=None, mode="auto", calibration_pages=2, recheck_every=50, timeouts=None,
+                 min_pages=5, default_strategy="keywords"):
+        self.signature_fn = signature_fn
+        self.mode = mode
+        self.calibration_pages = calibration_pages
+        self.recheck_every = recheck_every
+        self.timeouts = timeouts or {}
+        self.min_pages = min_pages
+        self.default_strategy = default_strategy
+        self.profiles = {}
+        self.expected = {}  # domain -> pages the frontier still holds for it
+        self.dirty = set()  # domains whose learned strategy changed since save()
+
+    def unprofiled(self, domains):
+        if self.mode != "auto" or self.signature_fn is None:
+            return set()
+        return {d for d in domains if d not in self.profiles or self.profiles[d].strategy is None}
+
+    def expect(self, domain, pages):
+        self.expected[domain] = pages
+
+    def plan(self, domain):
+        # returns (strategy, calibrate); calibrate means walk the ladder and snapshot
+        if self.mode != "auto":
+            return self.mode, False
+        if self.signature_fn is None:
+            return STRATEGIES[-1], False
+        p = self.profiles.setdefault(domain, _Profile())
+        if p.strategy is None and not p.votes and self.expected.get(domain, 0) < self.min_pages:
+            return self.default_strategy, False
+        if p.strategy is None or p.pages_since >= self.recheck_every:
+            return STRATEGIES[-1], True
+        p.pages_since += 1
+        return p.strategy, False
+
+    async def settle(self, page, domain):
+        """Wait for the page per the domain's plan; returns final html."""
+        strategy, calibrate = self.plan(domain)
+        if not calibrate:
+            with metrics.timer("readiness_seconds", strategy=strategy):
+                await wait_for(page, strategy, self.timeouts)
+            metrics.inc("readiness_strategy_total", strategy=strategy)
+            return await page.content()
+        snapshots = []
+        budget = self.timeouts.get("calibration_budget_ms", 10000) / 1000
+        t0 = time.perf_counter()
+        for s in STRATEGIES:
+            left = budget - (time.perf_counter() - t0)
+            if snapshots and left <= 0:
+                break  # the snapshots so far decide; the last one reached is the reference
+            await wait_for(page, s, self.timeouts, cap_ms=max(left, 0) * 1000)
+            snapshots.append((s, time.perf_counter() - t0, await page.content()))
+        metrics.inc("readiness_strategy_total", strategy="calibration")
+        await self._calibrate(domain, snapshots)
+        return snapshots[-1][2]
+
+    def _signatures(self, snapshots):
+        # identical snapshots are parsed once
+        by_html = {}
+        out = []
+        for s, elapsed, html in snapshots:
+            if html not in by_html:
+                by_html[html] = self.signature_fn(html)
+            out.append((s, elapsed, by_html[html]))
+        return out
+
+    async def _calibrate(self, domain, snapshots):
+        try:
+            # parsing is CPU-bound; keep it off the event loop
+            sigs = await asyncio.to_thread(self._signatures, snapshots)
+        except Exception as e:
+            logger.warning("Readiness calibration failed for %s: %s", domain, e)
+            return
+        reference = sigs[-1][2]
+        cheapest = next(s for s, _, sig in sigs if sig == reference)
+        p = self.profiles.setdefault(domain, _Profile())
+        p.votes.append(cheapest)
+        if len(p.votes) >= self.calibration_pages:
+            # the most demanding page decides, so no domain page loses fields
+            new = max(p.votes, key=STRATEGIES.index)
+            if new != p.strategy:
+                logger.info("Readiness for %s: %s (saves ~%.1fs/page)", domain, new,
+                            sigs[-1][1] - next((e for s, e, _ in sigs if s == new), sigs[-1][1]))
+                metrics.inc("readiness_profile_changes_total", strategy=new)
+                self.dirty.add(domain)
+            p.strategy = new
+            p.votes = []
+            p.pages_since = 0
+
+    async def load(self, session):
+        if self.mode != "auto":
+            return
+        for domain, strategy in await session.execute(select(ReadinessProfile.domain, ReadinessProfile.strategy)):
+            if strategy in STRATEGIES:
+                self.profiles.setdefault(domain, _Profile()).strategy = strategy
+        logger.info("Loaded readiness profiles for %d domains", len(self.profiles))
+
+    async def save(self, session):
+        rows = [{"domain": d, "strategy": self.profiles[d].strategy} for d in self.dirty if self.profiles[d].strategy]
+        self.dirty = set()
+        if not rows:
+            return 0
+        insert = postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert
+        stmt = insert(ReadinessProfile).values(rows)
+        await session.execute(stmt.on_conflict_do_update(index_elements=["domain"], set_={"strategy": stmt.excluded.strategy}))
+        await session.commit()
+        return len(rows)
@@ -0,0 +1,150 @@
+import argparse, datetime, multiprocessing, os, time
+from sqlalchemy import func, select
+from db import SessionLocal, init_db
+from models import RawPage, Resort
+from normalize import normalize_to_resort, apply_resort_fields, FIELD_COLUMNS
+from wrapper_induction import record_outcomes
+from logger_conf import setup_logger, configure_logging, log_synchronously
+
+logger = setup_logger("reprocess")
+
+_extractor = None
+_session = None
+
+def _init_worker(learn, log_level):
+    # each process gets its own connections and its own Extractor (and spaCy model);
+    # template hit/miss counts go back to the parent, which writes them once
+    global _extractor, _session
+    from extractor import Extractor
+    configure_logging(log_level)
+    log_synchronously()
+    _session = SessionLocal()
+    _extractor = Extractor(_session, learn=learn, tally_templates=True)
+
+def _extract(item):
+    url, domain, html = item
+    try:
+        resort = normalize_to_resort(url, _extractor.extract_all(html, domain=domain))
+    except Exception as e:
+        logger.warning("Re-extraction failed for %s: %s", url, e)
+        _session.rollback()
+        resort = None
+    return url, resort, _extractor.templates.take_outcomes()
+
+def merge_outcomes(total, outcomes):
+    for tid, (hits, misses) in outcomes.items():
+        t = total.setdefault(tid, [0, 0])
+        t[0] += hits
+        t[1] += misses
+
+def latest_page_ids(domains=None, since=None, until=None):
+    # id of the newest stored version of every URL
+    latest = select(func.max(RawPage.id)).where(RawPage.html.isnot(None)).group_by(RawPage.url)
+    if domains:
+        latest = latest.where(RawPage.domain.in_(domains))
+    if since:
+        latest = latest.where(RawPage.discovered_at >= since)
+    if until:
+        latest = latest.where(RawPage.discovered_at < until)
+    return latest
+
+def stream_pages(session, latest, chunk_size):
+    """Yield chunks of (url, domain, html) without loading the corpus.
+
+    session must be a dedicated read session. On Postgres it's one query over
+    a server-side cursor, which MVCC lets run alongside the upserts. On SQLite
+    an open read cursor would block the writer, so only the ids are read up
+    front and the HTML is fetched chunk by chunk."""
+    cols = (RawPage.url, RawPage.domain, RawPage.html)
+    if session.bind.dialect.name == "postgresql":
+        q = select(*cols).where(RawPage.id.in_(latest.scalar_subquery())).order_by(RawPage.id)
+        result = session.execute(q.execution_options(stream_results=True, yield_per=chunk_size))
+        for part in result.partitions(chunk_size):
+            yield [tuple(r) for r in part]
+        return
+    ids = sorted(session.scalars(latest).all())
+    session.commit()
+    for i in range(0, len(ids), chunk_size):
+        rows = session.execute(select(*cols).where(RawPage.id.in_(ids[i:i + chunk_size])).order_by(RawPage.id)).all()
+        session.commit()  # release the read lock before the chunk is written
+        yield [tuple(r) for r in rows]
+
+def upsert_chunk(session, results, fields=None, dry_run=False):
+    """Apply re-extracted resorts; returns {url: {column: (old, new)}}."""
+    columns = None
+    if fields:
+        columns = {c for f in fields for c in FIELD_COLUMNS.get(f, [])}
+    results = [(u, r) for u, r in results if r]
+    existing = {r.url: r for r in session.query(Resort).filter(Resort.url.in_([u for u, _ in results]))} if results else {}
+    diffs = {}
+    for url, resort in results:
+        raw = resort.pop("raw", None) or {}
+        row = existing.get(url)
+        if row is None:
+            if fields:
+                resort = {k: v for k, v in resort.items() if k == "url" or k in columns}
+            diffs[url] = {k: (None, v) for k, v in resort.items() if v is not None and k != "url"}
+            if not dry_run:
+                session.add(Resort(raw=raw, **resort))
+            continue
+        if dry_run:
+            diffs[url] = {k: (getattr(row, k), v) for k, v in resort.items()
+                          if v is not None and k != "url" and (columns is None or k in columns) and getattr(row, k) != v}
+            continue
+        changed = apply_resort_fields(row, resort, columns)
+        # raw keeps provenance for fields we didn't re-extract
+        merged = dict(row.raw or {})
+        merged.update({k: v for k, v in raw.items() if fields is None or k in fields})
+        row.raw = merged
+        if changed:
+            diffs[url] = changed
+    if not dry_run:
+        session.commit()
+    return diffs
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Re-run extraction over stored raw_pages without recrawling")
+    ap.add_argument("--domain", action="append", help="only pages from this domain (repeatable)")
+    ap.add_argument("--field", action="append", choices=sorted(FIELD_COLUMNS), help="only update this field (repeatable)")
+    ap.add_argument("--since", type=datetime.date.fromisoformat, help="pages fetched on/after this date (YYYY-MM-DD)")
+    ap.add_argument("--until", type=datetime.date.fromisoformat, help="pages fetched before this date (YYYY-MM-DD)")
+    ap.add_argument("--dry-run", action="store_true", help="print what would change and write nothing")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--chunk-size", type=int, default=200)
+    return ap.parse_args()
+
+def main():
+    args = parse_args()
+    configure_logging(os.environ.get("LOG_LEVEL", "INFO"))
+    init_db()
+    t0 = time.time()
+    session = SessionLocal()
+    read_session = SessionLocal()
+    pages = changed_rows = changed_fields = 0
+    latest = latest_page_ids(args.domain, args.since, args.until)
+    # spawn, not fork: a forked child would inherit the logging queue without its listener thread
+    with multiprocessing.get_context("spawn").Pool(
+            args.workers, initializer=_init_worker, initargs=(not args.dry_run, os.environ.get("LOG_LEVEL", "INFO"))) as pool:
+        for chunk in stream_pages(read_session, latest, args.chunk_size):
+            results = pool.map(_extract, chunk, chunksize=max(1, len(chunk) // (args.workers * 4)))
+            outcomes = {}
+            for _, _, o in results:
+                merge_outcomes(outcomes, o)
+            if not args.dry_run:
+                record_outcomes(session, outcomes)
+            diffs = upsert_chunk(session, [(u, r) for u, r, _ in results], args.field, args.dry_run)
+            pages += len(chunk)
+            changed_rows += len(diffs)
+            changed_fields += sum(len(d) for d in diffs.values())
+            if args.dry_run:
+                for url, d in diffs.items():
+                    for col, (old, new) in d.items():
+                        print(f"{url}\t{col}\t{old!r} -> {new!r}")
+            logger.info("Re-extracted %d pages (%.1f pages/s)", pages, pages / max(0.001, time.time() - t0))
+    read_session.close()
+    session.close()
+    logger.info("%s %d fields on %d resorts from %d pages in %.1fs",
+                "Would change" if args.dry_run else "Changed", changed_fields, changed_rows, pages, time.time() - t0)
+
+if __name__ == "__main__":
+    main()
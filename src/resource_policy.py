@@ -0,0 +1,108 @@
+from urllib.parse import urlparse
+from logger_conf import setup_logger, PER_URL
+from metrics import metrics, BYTES_BUCKETS
+
+logger = setup_logger("resource_policy")
+
+# the extractor only reads DOM text and HTML, so these never change what we extract
+DEFAULT_BLOCKED_TYPES = ("image", "media", "font")
+
+# ad, analytics and tag-manager hosts; subdomains match too
+DEFAULT_BLOCKED_HOSTS = (
+    "google-analytics.com", "analytics.google.com", "googletagmanager.com", "googletagservices.com",
+    "doubleclick.net", "googlesyndication.com", "googleadservices.com", "adservice.google.com",
+    "facebook.net", "connect.facebook.net", "hotjar.com", "hotjar.io", "clarity.ms", "bat.bing.com",
+    "segment.io", "segment.com", "mixpanel.com", "amplitude.com", "heap.io", "fullstory.com",
+    "nr-data.net", "newrelic.com", "optimizely.com", "quantserve.com", "scorecardresearch.com",
+    "criteo.com", "criteo.net", "taboola.com", "outbrain.com", "adnxs.com", "adsrvr.org",
+    "amazon-adsystem.com", "ads-twitter.com", "analytics.tiktok.com", "snap.licdn.com", "px.ads.linkedin.com",
+    "hs-analytics.net", "hs-banner.com", "cookielaw.org", "onetrust.com", "crazyegg.com", "mouseflow.com",
+)
+
+def _host_matches(host, hosts):
+    host = (host or "").lower()
+    return any(host == h or host.endswith("." + h) for h in hosts)
+
+
+class PageTraffic:
+    # per-page counters filled in by the route handler and the CDP listener
+    def __init__(self):
+        self.requests = 0
+        self.blocked = 0
+        self.bytes = 0
+        self.blocked_by = {}
+
+    def block(self, reason):
+        self.blocked += 1
+        self.blocked_by[reason] = self.blocked_by.get(reason, 0) + 1
+
+
+class ResourcePolicy:
+    """Request interception for rendered pages: drops resource types and
+    third-party hosts the extractor never looks at. allow maps a site domain
+    to {"types": [...], "hosts": [...]} that are let through for its pages
+    (e.g. a resort whose snow report only renders after a font or map tile
+    loads)."""
+
+    def __init__(self, enabled=True, blocked_types=DEFAULT_BLOCKED_TYPES, blocked_hosts=(), allow=None):
+        self.enabled = enabled
+        self.blocked_types = set(blocked_types or ())
+        self.blocked_hosts = tuple(DEFAULT_BLOCKED_HOSTS) + tuple(blocked_hosts or ())
+        self.allow = {d.lower(): v or {} for d, v in (allow or {}).items()}
+
+    def _overrides(self, page_domain):
+        page_domain = (page_domain or "").lower()
+        for d, v in self.allow.items():
+            if page_domain == d or page_domain.endswith("." + d):
+                return v
+        return {}
+
+    def decide(self, page_domain, request_url, resource_type):
+        # reason the request should be dropped, or None to let it through
+        if not self.enabled:
+            return None
+        allow = self._overrides(page_domain)
+        host = urlparse(request_url).hostname
+        if _host_matches(host, allow.get("hosts", ())):
+            return None
+        if resource_type in self.blocked_types and resource_type not in allow.get("types", ()):
+            return resource_type
+        if _host_matches(host, self.blocked_hosts):
+            return "tracker"
+        return None
+
+    async def attach(self, context, page, page_domain):
+        """Install the policy on a fresh context/page before navigation;
+        returns the PageTraffic the page's requests are counted into."""
+        traffic = PageTraffic()
+
+        async def handle(route):
+            request = route.request
+            traffic.requests += 1
+            reason = self.decide(page_domain, request.url, request.resource_type)
+            if reason is None:
+                await route.continue_()
+                return
+            traffic.block(reason)
+            await route.abort("blockedbyclient")
+
+        if self.enabled:
+            await context.route("**/*", handle)
+        try:
+            # encodedDataLength is what actually came over the wire, headers included
+            cdp = await context.new_cdp_session(page)
+            await cdp.send("Network.enable")
+            cdp.on("Network.loadingFinished", lambda e: setattr(traffic, "bytes", traffic.bytes + int(e.get("encodedDataLength", 0))))
+        except Exception as e:
+            logger.debug("No byte accounting for %s: %s", page_domain, e, extra=PER_URL)
+        return traffic
+
+    @staticmethod
+    def record(url, traffic):
+        metrics.observe("page_bytes", traffic.bytes, buckets=BYTES_BUCKETS)
+        metrics.inc("fetch_bytes_total", traffic.bytes)
+        metrics.inc("page_requests_total", traffic.requests)
+        for reason, n in traffic.blocked_by.items():
+            metrics.inc("requests_blocked_total", n, reason=reason)
+        logger.debug("%s: %d bytes, %d/%d requests blocked %s", url, traffic.bytes, traffic.blocked, traffic.requests,
+                     traffic.blocked_by, extra=PER_URL)
@@ -0,0 +1,120 @@
+import random, time
+from collections import namedtuple
+from logger_conf import setup_logger
+from metrics import metrics
+
+logger = setup_logger("retry")
+
+# error is None on success, otherwise one of the kinds below
+FetchResult = namedtuple("FetchResult", "status html blocked error")
+
+TRANSIENT = {"timeout", "connection", "server_error", "throttled", "browser", "aborted", "circuit_open", "other"}
+PERMANENT = {"dns", "not_found", "client_error", "tls", "invalid_url", "redirect_loop"}
+# failures that say the host itself is unwell, as opposed to one bad URL
+HOST_FAILURES = {"dns", "timeout", "connection", "server_error", "throttled"}
+
+_NET_ERRORS = (
+    ("ERR_NAME_NOT_RESOLVED", "dns"),
+    ("ERR_NAME_RESOLUTION_FAILED", "dns"),
+    ("ERR_CONNECTION_REFUSED", "connection"),
+    ("ERR_CONNECTION_RESET", "connection"),
+    ("ERR_CONNECTION_CLOSED", "connection"),
+    ("ERR_CONNECTION_TIMED_OUT", "timeout"),
+    ("ERR_TIMED_OUT", "timeout"),
+    ("ERR_ADDRESS_UNREACHABLE", "connection"),
+    ("ERR_INTERNET_DISCONNECTED", "connection"),
+    ("ERR_NETWORK_CHANGED", "connection"),
+    ("ERR_EMPTY_RESPONSE", "connection"),
+    ("ERR_CERT_", "tls"),
+    ("ERR_SSL_", "tls"),
+    ("ERR_INVALID_URL", "invalid_url"),
+    ("ERR_TOO_MANY_REDIRECTS", "redirect_loop"),
+    ("ERR_ABORTED", "aborted"),
+    ("Target page, context or browser has been closed", "browser"),
+    ("Browser has been closed", "browser"),
+)
+
+def classify_exception(exc):
+    msg = str(exc)
+    for marker, kind in _NET_ERRORS:
+        if marker in msg:
+            return kind
+    if "timeout" in type(exc).__name__.lower() or "Timeout" in msg[:200]:
+        return "timeout"
+    return "other"
+
+def classify_status(status):
+    # None for statuses whose page is worth extracting
+    if status is None or status < 400:
+        return None
+    if status in (404, 410):
+        return "not_found"
+    if status == 429:
+        return "throttled"
+    if status >= 500:
+        return "server_error"
+    return "client_error"
+
+def is_transient(kind):
+    return kind in TRANSIENT
+
+def backoff_delay(attempt, base=2.0, cap=600.0):
+    # "full jitter": spreads retries of a burst of failures over the window
+    return random.uniform(base, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """Per-domain breaker. failure_threshold consecutive host failures open
+    it; while open, fetches to that host are refused without touching the
+    network. After open_seconds one probe is let through (half-open): success
+    closes the breaker, failure re-opens it for twice as long, up to
+    max_open_seconds."""
+
+    def __init__(self, failure_threshold=5, open_seconds=60.0, max_open_seconds=900.0):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = {}  # domain -> dict(failures, opened_at, open_for, probing)
+
+    def _s(self, domain):
+        s = self.state.get(domain)
+        if s is None:
+            s = self.state[domain] = {"failures": 0, "opened_at": None, "open_for": self.open_seconds, "probing": False}
+        return s
+
+    def allow(self, domain):
+        s = self._s(domain)
+        if s["opened_at"] is None:
+            return True
+        if time.monotonic() - s["opened_at"] < s["open_for"] or s["probing"]:
+            return False
+        s["probing"] = True  # half-open: this caller is the probe
+        return True
+
+    def retry_in(self, domain):
+        s = self._s(domain)
+        if s["opened_at"] is None:
+            return 0.0
+        return max(1.0, s["open_for"] - (time.monotonic() - s["opened_at"]))
+
+    def record(self, domain, kind):
+        # kind is None for success, otherwise the classified error
+        s = self._s(domain)
+        if kind is None or kind not in HOST_FAILURES:
+            # any answer that isn't a host failure proves the host is back
+            if s["opened_at"] is not None:
+                logger.info("Circuit closed for %s", domain)
+                metrics.inc("circuit_transitions_total", state="closed")
+                s.update(opened_at=None, open_for=self.open_seconds)
+            s["failures"] = 0
+            s["probing"] = False
+            return
+        s["failures"] += 1
+        if s["probing"]:
+            s.update(opened_at=time.monotonic(), open_for=min(self.max_open_seconds, s["open_for"] * 2), probing=False)
+            metrics.inc("circuit_transitions_total", state="reopened")
+            logger.warning("Circuit re-opened for %s for %.0fs (%s)", domain, s["open_for"], kind)
+        elif s["opened_at"] is None and s["failures"] >= self.failure_threshold:
+            s.update(opened_at=time.monotonic(), open_for=self.open_seconds)
+            metrics.inc("circuit_transitions_total", state="open")
+            logger.warning("Circuit opened for %s after %d failures (%s)", domain, s["failures"], kind)
@@ -0,0 +1,192 @@
+import asyncio, datetime, re, zlib
+from contextlib import aclosing
+from urllib.parse import urljoin, urlparse
+import aiohttp
+from dateutil import parser as date_parser
+from lxml import etree
+from logger_conf import setup_logger, PER_URL
+from metrics import metrics
+
+logger = setup_logger("sitemap")
+
+# paths on a resort's own site that tend to carry the fields we extract
+RELEVANT_PATH = r"lift|ticket|pass(?:es)?\b|trail|piste|runs?\b|snow|season|hours|mountain|terrain|condition|report|rates|pric|operat|about|location|getting-here|direction|plan|stats|map|facts"
+# ... and ones that never do
+EXCLUDED_PATH = (r"/(?:blog|news|press|stories|articles?|events?|jobs|careers|employment|privacy|terms|legal|cookies?|login|account|"
+                 r"cart|checkout|shop|store|weddings?|real-estate|tags?|category|author|feed|search|gallery|media)(?:/|$)"
+                 r"|\.(?:pdf|jpe?g|png|gif|webp|svg|mp4|zip|ics|xml)$")
+# child sitemaps whose name says they list posts or products are read last, if at all
+_LOW_VALUE_SITEMAP = re.compile(r"post|news|blog|product|event|tag|category|author|image|video", re.I)
+
+def parse_lastmod(text):
+    # W3C datetime; naive UTC so it compares with the frontier's timestamps
+    if not text or not text.strip():
+        return None
+    try:
+        dt = date_parser.isoparse(text.strip())
+    except (ValueError, OverflowError):
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else None
+
+def _drain(parser):
+    """(kind, loc, lastmod) for each <url>/<sitemap> the parser has completed.
+    Finished elements are dropped from the tree so memory stays flat."""
+    for _, el in parser.read_events():
+        kind = _local(el.tag)
+        if kind not in ("url", "sitemap"):
+            continue
+        loc = lastmod = None
+        for child in el:
+            t = _local(child.tag)
+            if t == "loc":
+                loc = (child.text or "").strip()
+            elif t == "lastmod":
+                lastmod = parse_lastmod(child.text)
+        el.clear()
+        parent = el.getparent()
+        if parent is not None:
+            while el.getprevious() is not None:
+                del parent[0]
+        if loc:
+            yield kind, loc, lastmod
+
+def robots_sitemaps(robots_txt, base_url):
+    return [urljoin(base_url, line.split(":", 1)[1].strip()) for line in robots_txt.splitlines()
+            if line.strip().lower().startswith("sitemap:") and line.split(":", 1)[1].strip()]
+
+def _same_site(host, domain):
+    strip = lambda h: (h or "").split(":")[0].lower().removeprefix("www.")
+    host, domain = strip(host), strip(domain)
+    return host == domain or host.endswith("." + domain) or domain.endswith("." + host)
+
+
+class SitemapDiscovery:
+    """Finds a site's relevant pages from its XML sitemaps.
+
+    Sitemap locations come from robots.txt (falling back to /sitemap.xml).
+    Files are parsed as they download, gzip included, and sitemap indexes are
+    followed breadth-first up to max_depth. Only same-site URLs whose path
+    looks resort-relevant are kept, with their <lastmod> so the frontier can
+    skip pages that haven't changed since they were last crawled."""
+
+    def __init__(self, user_agent, max_urls_per_domain=300, max_sitemaps=20, max_depth=2,
+                 max_bytes=50 * 1024 * 1024, timeout=30, include=None, exclude=None):
+        self.user_agent = user_agent
+        self.max_urls_per_domain = max_urls_per_domain
+        self.max_sitemaps = max_sitemaps
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes  # per decompressed file; the protocol caps sitemaps at 50MB
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.include = re.compile(include or RELEVANT_PATH, re.I)
+        self.exclude = re.compile(exclude or EXCLUDED_PATH, re.I)
+        self.http = None
+
+    async def _session(self):
+        if self.http is None:
+            self.http = aiohttp.ClientSession(headers={"User-Agent": self.user_agent}, timeout=self.timeout)
+        return self.http
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.close()
+            self.http = None
+
+    def relevant(self, url):
+        path = urlparse(url).path or "/"
+        if path in ("", "/"):
+            return True
+        return not self.exclude.search(path) and bool(self.include.search(path))
+
+    async def sitemap_locations(self, domain):
+        base = f"https://{domain}/"
+        http = await self._session()
+        try:
+            async with http.get(urljoin(base, "/robots.txt")) as resp:
+                if resp.status == 200:
+                    found = robots_sitemaps(await resp.text(errors="replace"), base)
+                    if found:
+                        return found
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug("robots.txt unavailable for %s: %s", domain, e, extra=PER_URL)
+        return [urljoin(base, "/sitemap.xml")]
+
+    async def _stream(self, url):
+        """Yield (kind, loc, lastmod) from one sitemap file while it downloads."""
+        http = await self._session()
+        parser = etree.XMLPullParser(events=("end",), resolve_entities=False, no_network=True, recover=True)
+        total = 0
+        decomp = None
+        with metrics.timer("sitemap_fetch_seconds"):
+            async with http.get(url) as resp:
+                if resp.status != 200:
+                    metrics.inc("sitemap_files_total", outcome=f"http_{resp.status}")
+                    return
+                first = True
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    if first:
+                        first = False
+                        # .xml.gz files are served as-is; HTTP-level gzip is already undone by aiohttp
+                        if chunk[:2] == b"\x1f\x8b":
+                            decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    room = self.max_bytes - total
+                    data = decomp.decompress(chunk, room + 1) if decomp else chunk
+                    total += len(data)
+                    if total > self.max_bytes:
+                        logger.warning("Sitemap %s exceeds %d bytes, truncated", url, self.max_bytes)
+                        metrics.inc("sitemap_files_total", outcome="truncated")
+                        parser.feed(data[:max(0, room)])
+                        break
+                    parser.feed(data)
+                    for item in _drain(parser):
+                        yield item
+                else:
+                    if decomp:
+                        parser.feed(decomp.flush())
+                    metrics.inc("sitemap_files_total", outcome="ok")
+        metrics.inc("sitemap_bytes_total", total)
+        try:
+            parser.close()
+        except etree.XMLSyntaxError:
+            pass
+        for item in _drain(parser):
+            yield item
+
+    async def discover(self, domain):
+        """[(url, lastmod)] of relevant pages on domain, at most max_urls_per_domain."""
+        queue = [(u, 0) for u in await self.sitemap_locations(domain)]
+        visited, found = set(), {}
+        while queue and len(visited) < self.max_sitemaps and len(found) < self.max_urls_per_domain:
+            url, depth = queue.pop(0)
+            if url in visited:
+                continue
+            visited.add(url)
+            children = []
+            try:
+                # aclosing: stopping early must still release the connection
+                async with aclosing(self._stream(url)) as entries:
+                    async for kind, loc, lastmod in entries:
+                        if kind == "sitemap":
+                            if depth < self.max_depth and _same_site(urlparse(loc).hostname, domain):
+                                children.append(loc)
+                            continue
+                        metrics.inc("sitemap_urls_total", outcome="seen")
+                        if not _same_site(urlparse(loc).hostname, domain) or not self.relevant(loc):
+                            continue
+                        if loc not in found or (lastmod and (found[loc] is None or lastmod > found[loc])):
+                            found[loc] = lastmod
+                        if len(found) >= self.max_urls_per_domain:
+                            break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                metrics.inc("sitemap_files_total", outcome="error")
+                logger.info("Sitemap %s failed: %s", url, e)
+                continue
+            # pages/resort sitemaps before post/product ones
+            queue.extend((c, depth + 1) for c in sorted(children, key=lambda c: bool(_LOW_VALUE_SITEMAP.search(c))))
+        metrics.inc("sitemap_urls_total", len(found), outcome="relevant")
+        logger.info("Sitemaps for %s: %d relevant URLs from %d files", domain, len(found), len(visited))
+        return list(found.items())
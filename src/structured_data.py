@@ -0,0 +1,179 @@
+import json, re
+from dateparser import parse as parse_date
+from logger_conf import setup_logger
+
+logger = setup_logger("structured_data")
+
+# schema.org types that describe the resort itself rather than e.g. a hotel on the page
+RESORT_TYPES = {"skiresort", "resort", "place", "touristattraction", "touristdestination", "sportsactivitylocation",
+                "localbusiness", "landmarksorhistoricalbuildings", "park"}
+
+# ISO 3166 alpha-2 codes of countries with ski areas, to the names skiresort.info
+# (and so entity_resolution's merge) uses, so Resort.country has one spelling
+COUNTRY_CODES = {
+    "AF": "Afghanistan", "AL": "Albania", "DZ": "Algeria", "AD": "Andorra", "AR": "Argentina", "AM": "Armenia",
+    "AU": "Australia", "AT": "Austria", "AZ": "Azerbaijan", "BH": "Bahrain", "BY": "Belarus", "BE": "Belgium",
+    "BA": "Bosnia and Herzegovina", "BR": "Brazil", "BG": "Bulgaria", "CA": "Canada", "CL": "Chile", "CN": "China",
+    "CO": "Colombia", "HR": "Croatia", "CY": "Cyprus", "CZ": "Czech Republic", "DK": "Denmark", "EG": "Egypt",
+    "EE": "Estonia", "FI": "Finland", "FR": "France", "GE": "Georgia", "DE": "Germany", "GR": "Greece",
+    "GL": "Greenland", "HU": "Hungary", "IS": "Iceland", "IN": "India", "ID": "Indonesia", "IR": "Iran", "IQ": "Iraq",
+    "IE": "Ireland", "IL": "Israel", "IT": "Italy", "JP": "Japan", "KZ": "Kazakhstan", "XK": "Kosovo",
+    "KG": "Kyrgyzstan", "LV": "Latvia", "LB": "Lebanon", "LS": "Lesotho", "LI": "Liechtenstein", "LT": "Lithuania",
+    "MY": "Malaysia", "MX": "Mexico", "MD": "Moldova", "MN": "Mongolia", "ME": "Montenegro", "MA": "Morocco",
+    "MM": "Myanmar", "NA": "Namibia", "NP": "Nepal", "NL": "Netherlands", "NZ": "New Zealand", "KP": "North Korea",
+    "MK": "North Macedonia", "NO": "Norway", "OM": "Oman", "PK": "Pakistan", "PE": "Peru", "PL": "Poland",
+    "PT": "Portugal", "QA": "Qatar", "RO": "Romania", "RU": "Russia", "SA": "Saudi Arabia", "RS": "Serbia",
+    "SG": "Singapore", "SK": "Slovakia", "SI": "Slovenia", "ZA": "South Africa", "KR": "South Korea", "ES": "Spain",
+    "LK": "Sri Lanka", "SE": "Sweden", "CH": "Switzerland", "TJ": "Tajikistan", "TH": "Thailand", "TR": "Turkey",
+    "TM": "Turkmenistan", "UA": "Ukraine", "AE": "United Arab Emirates", "GB": "United Kingdom", "UK": "United Kingdom",
+    "US": "USA", "UZ": "Uzbekistan", "VN": "Vietnam",
+}
+
+def country_name(value):
+    # country names pass through; codes are mapped, and unknown codes dropped
+    value = (value or "").strip()
+    if re.fullmatch(r"[A-Za-z]{2}", value):
+        return COUNTRY_CODES.get(value.upper())
+    return value or None
+
+def _hit(value, raw, confidence):
+    return {"value": value, "raw": raw, "confidence": confidence}
+
+def _float(v):
+    try:
+        return float(str(v).strip())
+    except (TypeError, ValueError):
+        return None
+
+def _types(node):
+    t = node.get("@type", [])
+    if isinstance(t, str):
+        t = [t]
+    return {x.lower() for x in t if isinstance(x, str)}
+
+def _walk(obj):
+    # every dict in a JSON-LD document, including @graph members and nested values
+    if isinstance(obj, dict):
+        yield obj
+        for v in obj.values():
+            yield from _walk(v)
+    elif isinstance(obj, list):
+        for v in obj:
+            yield from _walk(v)
+
+def _country(addr):
+    if isinstance(addr, dict):
+        c = addr.get("addressCountry")
+        if isinstance(c, dict):
+            c = c.get("name")
+        return country_name(c) if isinstance(c, str) else None
+    return None
+
+def _from_jsonld(soup, out):
+    for script in soup.find_all("script", attrs={"type": re.compile(r"application/ld\+json", re.I)}):
+        try:
+            doc = json.loads(script.string or script.get_text() or "")
+        except ValueError:
+            continue
+        for node in _walk(doc):
+            types = _types(node)
+            resort_like = bool(types & RESORT_TYPES)
+            conf = 0.95 if "skiresort" in types else 0.9
+            if resort_like and isinstance(node.get("name"), str) and "name" not in out:
+                out["name"] = _hit(node["name"].strip(), node["name"], conf)
+            geo = node.get("geo")
+            if resort_like and isinstance(geo, dict):
+                lat, lon = _float(geo.get("latitude")), _float(geo.get("longitude"))
+                if lat is not None and lon is not None and "lat" not in out:
+                    out["lat"] = _hit(lat, json.dumps(geo), conf)
+                    out["lon"] = _hit(lon, json.dumps(geo), conf)
+            address = node.get("address") if resort_like else None
+            country = _country(address)
+            if country and "country" not in out:
+                out["country"] = _hit(country, json.dumps(address)[:200], conf)
+            specs = node.get("openingHoursSpecification") if resort_like else None
+            for spec in specs if isinstance(specs, list) else [specs]:
+                if not isinstance(spec, dict):
+                    continue
+                for key, field in (("validFrom", "opening_date"), ("validThrough", "closing_date")):
+                    dt = parse_date(str(spec.get(key))) if spec.get(key) else None
+                    if dt and field not in out:
+                        out[field] = _hit(dt.date(), spec.get(key), 0.85)
+            if "offer" in types or "aggregateoffer" in types:
+                name = str(node.get("name") or node.get("description") or "").lower()
+                price = _float(node.get("price") if node.get("price") is not None else node.get("lowPrice"))
+                if price is None or (node.get("priceCurrency") or "USD").upper() != "USD":
+                    continue
+                if "season" in name and "season_pass_price" not in out:
+                    out["season_pass_price"] = _hit(price, json.dumps(node)[:500], 0.85)
+                elif re.search(r"day|lift ticket", name) and "day_pass_price" not in out:
+                    out["day_pass_price"] = _hit(price, json.dumps(node)[:500], 0.85)
+
+def _meta(soup, *names):
+    for n in names:
+        tag = soup.find("meta", attrs={"name": n}) or soup.find("meta", attrs={"property": n})
+        if tag and tag.get("content"):
+            return tag["content"].strip()
+    return None
+
+def _from_meta(soup, out):
+    pos = _meta(soup, "geo.position", "ICBM")
+    if pos and "lat" not in out:
+        parts = re.split(r"[;,]\s*", pos)
+        if len(parts) == 2 and _float(parts[0]) is not None and _float(parts[1]) is not None:
+            out["lat"] = _hit(_float(parts[0]), pos, 0.9)
+            out["lon"] = _hit(_float(parts[1]), pos, 0.9)
+    lat = _float(_meta(soup, "place:location:latitude", "og:latitude"))
+    lon = _float(_meta(soup, "place:location:longitude", "og:longitude"))
+    if lat is not None and lon is not None and "lat" not in out:
+        out["lat"] = _hit(lat, str(lat), 0.9)
+        out["lon"] = _hit(lon, str(lon), 0.9)
+    region = _meta(soup, "geo.region")  # ISO 3166, e.g. "US-UT"
+    country = country_name(region.split("-")[0]) if region else None
+    if country and "country" not in out:
+        out["country"] = _hit(country, region, 0.85)
+    raw = _meta(soup, "og:country-name", "og:country_name")
+    country = country_name(raw)
+    if country and "country" not in out:
+        out["country"] = _hit(country, raw, 0.85)
+    site = _meta(soup, "og:site_name")
+    if site and "name" not in out:
+        out["name"] = _hit(site, site, 0.85)
+
+def _from_microdata(soup, out):
+    def prop(name):
+        tag = soup.find(attrs={"itemprop": name})
+        if not tag:
+            return None
+        return (tag.get("content") or tag.get_text(" ", strip=True) or "").strip() or None
+    lat, lon = _float(prop("latitude")), _float(prop("longitude"))
+    if lat is not None and lon is not None and "lat" not in out:
+        out["lat"] = _hit(lat, str(lat), 0.9)
+        out["lon"] = _hit(lon, str(lon), 0.9)
+    raw = prop("addressCountry")
+    country = country_name(raw)
+    if country and "country" not in out:
+        out["country"] = _hit(country, raw, 0.85)
+    scope = soup.find(attrs={"itemtype": re.compile(r"schema\.org/SkiResort", re.I)})
+    if scope and "name" not in out:
+        name = scope.find(attrs={"itemprop": "name"})
+        if name:
+            value = (name.get("content") or name.get_text(" ", strip=True)).strip()
+            if value:
+                out["name"] = _hit(value, value, 0.9)
+
+def extract_structured(soup):
+    """Fields published as schema.org JSON-LD, microdata, OpenGraph or geo
+    meta tags. Sources are tried most-specific first; the first one to
+    produce a field wins."""
+    out = {}
+    for fn in (_from_jsonld, _from_microdata, _from_meta):
+        try:
+            fn(soup, out)
+        except Exception as e:
+            logger.warning("Structured data parse error in %s: %s", fn.__name__, e)
+    lat, lon = out.get("lat", {}).get("value"), out.get("lon", {}).get("value")
+    if lat is not None and not (-90 <= lat <= 90 and lon is not None and -180 <= lon <= 180):
+        out.pop("lat", None)
+        out.pop("lon", None)
+    return out
@@ -1,5 +1,5 @@
-import asyncio, random, time
-from urllib.parse import urlparse
+import asyncio, random, re, time
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 import aiohttp
 import logging
 from logger_conf import setup_logger
@@ -27,3 +27,44 @@ def allowed_by_robots(url, user_agent):
     except Exception as e:
         logger.warning("Robots.txt check failed for %s: %s", robots_url, e)
         return True
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "dclid", "yclid", "mc_cid", "mc_eid", "_ga", "_gl", "ref", "ref_src", "igshid", "spm"}
+
+def canonicalize_url(url):
+    """Dedup key for the frontier: scheme/www/port/fragment/trailing-slash and
+    tracking-parameter variants of a URL all map to the same string."""
+    try:
+        parts = urlparse(url.strip())
+    except Exception:
+        return url
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    try:
+        port = parts.port
+    except ValueError:
+        port = None  # malformed (":abc", ":99999"); key on the host alone
+    port = port if port not in (80, 443) else None
+    netloc = f"{host}:{port}" if port else host
+    path = re.sub(r"/{2,}", "/", parts.path or "/")
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS]
+    return urlunparse(("https", netloc, path, "", urlencode(sorted(query)), ""))
+
+# sites that list or review resorts rather than being one
+AGGREGATOR_DOMAINS = ("skiresort.info", "powderhounds.com", "snowmagazine.com", "onthesnow.com", "wikipedia.org",
+                      "tripadvisor.com", "skimag.com", "snow-forecast.com", "ski.com", "liftopia.com", "bergfex.com")
+SOCIAL_DOMAINS = ("facebook.com", "instagram.com", "twitter.com", "x.com", "youtube.com", "tiktok.com",
+                  "linkedin.com", "pinterest.com", "reddit.com", "duckduckgo.com", "google.com", "bing.com")
+
+def source_type(url_or_domain):
+    """Classify a URL or bare host as "aggregator", "social" or "official"."""
+    host = (urlparse(url_or_domain).hostname if "//" in url_or_domain else url_or_domain.split(":")[0]) or ""
+    host = host.lower()
+    for kind, domains in (("aggregator", AGGREGATOR_DOMAINS), ("social", SOCIAL_DOMAINS)):
+        if any(host == d or host.endswith("." + d) for d in domains):
+            return kind
+    return "official"
@@ -0,0 +1,318 @@
+import asyncio, datetime, re
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from dateparser import parse as parse_date
+from models import SelectorTemplate
+from logger_conf import setup_logger
+
+logger = setup_logger("wrapper_induction")
+
+# runs_breakdown spans several nodes, so it isn't templated
+TEMPLATE_FIELDS = ["name", "country", "continent", "lat", "lon", "snowfall", "opening_date", "closing_date", "num_lifts", "day_pass_price", "season_pass_price"]
+MIN_CONFIDENCE = 0.3
+# only tiers precise enough to teach a selector; auto_pattern guesses are not
+LEARN_TIERS = ("regex", "spacy")
+
+# countries with ski areas (the skiresort.info list) and common variants
+COUNTRIES = {c.lower() for c in (
+    "Afghanistan", "Albania", "Algeria", "Andorra", "Argentina", "Armenia", "Australia", "Austria", "Azerbaijan", "Bahrain",
+    "Belarus", "Belgium", "Bosnia and Herzegovina", "Brazil", "Bulgaria", "Canada", "Chile", "China", "Colombia", "Croatia",
+    "Cyprus", "Czech Republic", "Czechia", "Denmark", "Egypt", "Estonia", "Finland", "France", "Georgia", "Germany", "Greece",
+    "Greenland", "Hungary", "Iceland", "India", "Indonesia", "Iran", "Iraq", "Ireland", "Israel", "Italy", "Japan", "Kazakhstan",
+    "Kosovo", "Kyrgyzstan", "Latvia", "Lebanon", "Lesotho", "Liechtenstein", "Lithuania", "Malaysia", "Mexico", "Moldova",
+    "Mongolia", "Montenegro", "Morocco", "Myanmar", "Namibia", "Nepal", "Netherlands", "New Zealand", "North Korea",
+    "North Macedonia", "Norway", "Oman", "Pakistan", "Peru", "Poland", "Portugal", "Qatar", "Romania", "Russia", "Saudi Arabia",
+    "Serbia", "Singapore", "Slovakia", "Slovenia", "South Africa", "South Korea", "Korea", "Spain", "Sri Lanka", "Sweden",
+    "Switzerland", "Tajikistan", "Thailand", "Turkey", "Turkmenistan", "Ukraine", "United Arab Emirates", "United Kingdom", "UK",
+    "England", "Scotland", "Wales", "USA", "US", "U.S.", "U.S.A.", "United States", "United States of America", "Uzbekistan",
+    "Vietnam",
+)}
+CONTINENTS = {"europe", "asia", "africa", "north america", "south america", "australia", "oceania", "australia and oceania", "antarctica"}
+_ID = re.compile(r"^[A-Za-z][\w-]*$")
+
+def css_path(el):
+    # nth-of-type chain up to the nearest ancestor with a usable id
+    parts = []
+    while el is not None and el.name not in ("[document]", "html"):
+        if el.get("id") and _ID.match(el["id"]):
+            parts.append(f"{el.name}#{el['id']}")
+            break
+        idx = 1 + sum(1 for _ in el.find_previous_siblings(el.name))
+        parts.append(f"{el.name}:nth-of-type({idx})")
+        el = el.parent
+    return " > ".join(reversed(parts))
+
+def _num(pattern, text):
+    m = re.search(pattern, text)
+    return m.group(1) if m else None
+
+def page_names(soup):
+    # what the page says it is: <title> and the og:site_name/og:title tags
+    names = [soup.title.get_text(" ", strip=True)] if soup is not None and soup.title else []
+    for prop in ("og:site_name", "og:title"):
+        tag = soup.find("meta", attrs={"property": prop}) if soup is not None else None
+        if tag and tag.get("content"):
+            names.append(tag["content"])
+    return " ".join(names).lower()
+
+def _plausible_name(text, soup):
+    if not 2 <= len(text) <= 100:
+        return False
+    # most of the name's words have to appear in the page's own title, so a
+    # selector that drifted onto a nav label or button stops matching
+    words = [w for w in re.findall(r"\w+", text.lower()) if len(w) > 2]
+    if not words:
+        return False
+    known = set(re.findall(r"\w+", page_names(soup)))
+    return sum(w in known for w in words) * 2 > len(words)
+
+def parse_node_value(field, text, soup=None):
+    """Typed value of a field from one node's text, or None if the node no
+    longer looks like that field. soup is the whole page, for fields checked
+    against it (name)."""
+    text = " ".join(text.split())
+    if not text:
+        return None
+    if field == "name":
+        return text if _plausible_name(text, soup) else None
+    if field in ("country", "continent"):
+        vocab = COUNTRIES if field == "country" else CONTINENTS
+        return text if text.strip(" .,:;").lower() in vocab else None
+    if field in ("lat", "lon"):
+        v = _num(r"(-?\d{1,3}\.\d{3,})", text)
+        limit = 90 if field == "lat" else 180
+        return float(v) if v is not None and -limit <= float(v) <= limit else None
+    if field == "snowfall":
+        m = re.search(r"(\d{1,4}(?:\.\d)?)\s*(cm|inches|inch|in\b|\")", text, re.I)
+        if not m:
+            return None
+        v = float(m.group(1)) / (2.54 if m.group(2).lower() == "cm" else 1)
+        return v if 1 <= v <= 2000 else None
+    if field == "num_lifts":
+        v = _num(r"\b(\d{1,3})\b", text)
+        return int(v) if v is not None and 1 <= int(v) <= 300 else None
+    if field in ("day_pass_price", "season_pass_price"):
+        v = _num(r"\$?\s*(\d{1,5}(?:\.\d{1,2})?)", text)
+        lo, hi = (1, 1000) if field == "day_pass_price" else (50, 20000)
+        return float(v) if v is not None and lo <= float(v) <= hi else None
+    if field in ("opening_date", "closing_date"):
+        dt = parse_date(text[:60])
+        return dt.date() if dt else None
+    return None
+
+def _value_text(value):
+    if isinstance(value, bool) or isinstance(value, (datetime.date, datetime.datetime)):
+        return None
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else f"{value:g}"
+    return str(value) if value is not None else None
+
+def _same(a, b):
+    if isinstance(a, float) or isinstance(b, float):
+        try:
+            return abs(float(a) - float(b)) < 0.01
+        except (TypeError, ValueError):
+            return False
+    if isinstance(a, (datetime.date, datetime.datetime)) and isinstance(b, (datetime.date, datetime.datetime)):
+        return (a.month, a.day) == (b.month, b.day)
+    return str(a).strip().lower() == str(b).strip().lower()
+
+
+class TemplateBank:
+    """Per-domain selector templates (wrapper induction).
+
+    After the text tiers find a field, learn() locates the DOM node the value
+    came from and records its CSS path for that domain. Later pages of the
+    domain try apply() first: a selector whose node still parses to a valid
+    value is a hit, otherwise a miss, and confidence is the smoothed hit rate.
+    Templates below MIN_CONFIDENCE are no longer tried.
+
+    With an AsyncSession, preload() must run before a domain's pages are
+    extracted and save() writes the changes; apply() and learn() stay
+    synchronous and only touch the cache.
+
+    learn=False leaves the stored templates untouched: hits and misses are
+    not counted and nothing is written. tally=True counts them in outcomes
+    ({template_id: [hits, misses]}) instead of on the rows, for processes
+    that hand them to one writer (see record_outcomes)."""
+
+    def __init__(self, session, lock=None, learn=True, tally=False):
+        self.session = session
+        self.is_async = isinstance(session, AsyncSession)
+        self.learning = learn
+        self.tally = tally
+        self.outcomes = {}
+        self._cache = {}  # domain -> {field: [SelectorTemplate]}
+        self._loaded = set()
+        self._pending = []
+        self._lock = lock or asyncio.Lock()
+        self.dirty = False
+
+    async def preload(self, domain):
+        if domain in self._loaded:
+            return
+        async with self._lock:
+            if domain in self._loaded:
+                return
+            res = await self.session.execute(select(SelectorTemplate).where(SelectorTemplate.domain == domain)
+                                             .order_by(SelectorTemplate.confidence.desc()))
+            by_field = self._cache.setdefault(domain, {})
+            for r in res.scalars():
+                by_field.setdefault(r.field, []).append(r)
+            self._loaded.add(domain)
+
+    def _load(self, domain):
+        if self.is_async:
+            return self._cache.setdefault(domain, {})
+        if domain not in self._cache:
+            by_field = {}
+            rows = self.session.query(SelectorTemplate).filter(SelectorTemplate.domain == domain).order_by(SelectorTemplate.confidence.desc()).all()
+            for r in rows:
+                by_field.setdefault(r.field, []).append(r)
+            self._cache[domain] = by_field
+        return self._cache[domain]
+
+    @staticmethod
+    def _score(t):
+        t.confidence = (t.hits + 1) / (t.hits + t.misses + 2)
+
+    def apply(self, soup, domain, field):
+        for t in self._load(domain).get(field, []):
+            if t.confidence < MIN_CONFIDENCE:
+                continue
+            try:
+                node = soup.select_one(t.selector)
+            except Exception:
+                node = None
+            value = None
+            if node is not None:
+                value = parse_node_value(field, node.get("content") or node.get_text(" ", strip=True), soup)
+            self._count(t, domain, value is not None)
+            if value is None:
+                continue
+            return {"value": value, "raw": node.get_text(" ", strip=True)[:200], "confidence": min(0.9, t.confidence), "template_id": t.id}
+        return None
+
+    def _count(self, t, domain, hit):
+        if self.tally:
+            if t.id is not None:
+                self.outcomes.setdefault(t.id, [0, 0])[0 if hit else 1] += 1
+            return
+        if not self.learning:
+            return
+        if hit:
+            t.hits += 1
+            t.last_hit_at = datetime.datetime.utcnow()
+        else:
+            t.misses += 1
+        self._score(t)
+        self.dirty = True
+        if not hit and t.confidence < MIN_CONFIDENCE:
+            logger.info("Demoted template %s/%s: %s", domain, t.field, t.selector)
+
+    def take_outcomes(self):
+        out, self.outcomes = self.outcomes, {}
+        return out
+
+    def has_active(self, domain, field):
+        return any(t.confidence >= MIN_CONFIDENCE for t in self._load(domain).get(field, []))
+
+    def _locate(self, soup, raw, value):
+        # candidate nodes: ones holding the matched snippet, and ones holding
+        # the bare value next to the snippet's leading words
+        raw = " ".join(str(raw or "").split())
+        context = raw[:12].lower()
+        keys = [(raw[:30], False)] if len(raw) >= 2 else []
+        vs = _value_text(value)
+        if vs:
+            keys.append((vs, True))
+        for key, need_context in keys:
+            for s in soup.find_all(string=lambda s, k=key: k in " ".join(s.split())):
+                chain = []
+                el = s.parent
+                for _ in range(3):
+                    if el is None or el.name in ("script", "style", "noscript", "[document]"):
+                        break
+                    chain.append(el)
+                    el = el.parent
+                for c in chain:
+                    # a bare number only counts inside the element that also holds its label
+                    if not need_context or context in c.get_text(" ", strip=True).lower():
+                        yield c
+
+    def learn(self, soup, domain, field, hit):
+        if field not in TEMPLATE_FIELDS or not hit or hit.get("value") is None or self.has_active(domain, field):
+            return None
+        # most specific node first: shortest text that still parses back to the value
+        candidates = {id(el): el for el in self._locate(soup, hit.get("raw"), hit["value"])}.values()
+        for el in sorted(candidates, key=lambda e: len(e.get_text(" ", strip=True))):
+            parsed = parse_node_value(field, el.get("content") or el.get_text(" ", strip=True), soup)
+            if parsed is None or not _same(parsed, hit["value"]):
+                continue
+            selector = css_path(el)
+            if not selector or any(t.selector == selector for t in self._load(domain).get(field, [])):
+                return None
+            t = SelectorTemplate(domain=domain, field=field, selector=selector, hits=1, misses=0, confidence=0.67)
+            self._pending.append(t)
+            self._load(domain).setdefault(field, []).append(t)
+            self.dirty = True
+            logger.info("Learned template %s/%s: %s", domain, field, selector)
+            return t
+        return None
+
+    def flush(self):
+        # async sessions are written by save() instead
+        if self.is_async or not self.learning or not (self.dirty or self._pending):
+            return
+        self.session.add_all(self._pending)
+        self._pending = []
+        try:
+            self.session.commit()
+        except IntegrityError:
+            # another process learned the same selector first
+            self.session.rollback()
+        self.dirty = False
+
+    async def save(self):
+        # False if the write failed; the session was rolled back, see reset()
+        if not self.learning or not (self.dirty or self._pending):
+            return True
+        async with self._lock:
+            pending, self._pending = self._pending, []
+            self.dirty = False
+            self.session.add_all(pending)
+            try:
+                await self.session.commit()
+            except IntegrityError:
+                # another process learned the same selector first
+                await self.session.rollback()
+                return False
+            except SQLAlchemyError as e:
+                await self.session.rollback()
+                logger.warning("Dropped %d learned templates and their counts: %s", len(pending), e)
+                return False
+        return True
+
+    def reset(self):
+        # a rollback expires the cached rows; preload() fetches them again
+        self._cache = {}
+        self._loaded = set()
+        self._pending = []
+        self.dirty = False
+
+
+def record_outcomes(session, outcomes):
+    """Add tallied {template_id: [hits, misses]} to the stored templates and
+    re-score them, in one transaction."""
+    if not outcomes:
+        return 0
+    now = datetime.datetime.utcnow()
+    for tid, (hits, misses) in outcomes.items():
+        values = {"hits": SelectorTemplate.hits + hits, "misses": SelectorTemplate.misses + misses,
+                  "confidence": (SelectorTemplate.hits + hits + 1.0) / (SelectorTemplate.hits + SelectorTemplate.misses + hits + misses + 2)}
+        if hits:
+            values["last_hit_at"] = now
+        session.execute(update(SelectorTemplate).where(SelectorTemplate.id == tid).values(**values))
+    session.commit()
+    return len(outcomes)
@@ -0,0 +1,40 @@
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from models import Base, SelectorTemplate
+
+try:
+    from extractor import Extractor
+except (ImportError, OSError) as e:  # spaCy or its en_core_web_sm model missing
+    pytest.skip(f"extractor unavailable: {e}", allow_module_level=True)
+
+PAGE = """<html><head><title>Example Mountain</title></head><body>
+<div id="stats"><p>Total lifts: 12</p><p>Annual average snowfall: 300 in</p></div>
+</body></html>"""
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as s:
+        yield s
+
+
+def test_extract_all_learns_templates_from_regex_hits(session):
+    ex = Extractor(session, learn=True)
+    result = ex.extract_all(PAGE, domain="example.com")
+    assert result["num_lifts"]["tier"] == "regex"
+    assert session.query(SelectorTemplate).filter_by(domain="example.com", field="num_lifts").count() == 1
+    # the next page of the site is answered by the learned selector
+    assert ex.extract_all(PAGE, domain="example.com")["num_lifts"]["tier"] == "template"
+
+
+def test_extract_all_without_learning_writes_nothing(session):
+    ex = Extractor(session, learn=False)
+    ex.extract_all(PAGE, domain="example.com")
+    assert session.query(SelectorTemplate).count() == 0